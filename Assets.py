@@ -0,0 +1,163 @@
+"""
+author: Ofri Guz
+Date: 01/06/24
+description: assets class that loads the images of the game once and serves them from memory
+run it to build the raw asset cache: the card faces packed into one atlas and the background, pre-scaled
+"""
+import logging
+import mmap
+import os
+import struct
+import pygame
+
+#  constants
+NUM_OF_CARDS = 12  # Cards 0 to 11, each with its own image
+CARD_WIDTH = 120  # Width of a card
+CARD_HEIGHT = 150  # Height of a card
+CARD_FILE = "card_{}.jpg"  # Image file of a card, by card value
+BACKGROUND = "background.jpg"
+CACHE_FILE = "assets.cache"  # Raw pixels of the atlas and the background, built by build_cache
+CACHE_MAGIC = b'8HAC'
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('!4sBBHHHH')  # magic, version, cards, card width, card height, background size
+PIXEL_FORMAT = 'RGB'
+BYTES_PER_PIXEL = 3
+
+
+class Assets:
+    """
+    Holds the card faces in one atlas and the background, in the pixel format of the display
+    they are read from the raw asset cache when it is up to date, so starting needs no image decoding;
+    otherwise the images are decoded and scaled once and the cache is written for the next start
+    every card is a subsurface of the atlas, so drawing is a plain blit
+    """
+    def __init__(self, cache_file=CACHE_FILE):
+        """
+        Initialize the assets, the display mode must already be set for convert()
+        :param cache_file: the raw asset cache
+        """
+        images = load_cache(cache_file)
+        if images is None:
+            atlas, background = decode_images()
+            try:
+                write_cache(cache_file, atlas, background)
+            except OSError as e:
+                logging.warning("could not write the asset cache: %s", e)
+        else:
+            atlas, background = images
+        self.atlas = atlas.convert()
+        self.background_image = background.convert()
+        self.cards = [self.atlas.subsurface(card_rect(card_value)) for card_value in range(NUM_OF_CARDS)]
+
+    def card(self, card_value):
+        """
+        Get the image of a card
+        :param card_value: Value of the card
+        :return: the card's image, in the size of a card
+        :rtype: pygame.Surface
+        """
+        return self.cards[card_value]
+
+    def background(self):
+        """
+        Get the background image
+        :return: the background image
+        :rtype: pygame.Surface
+        """
+        return self.background_image
+
+
+def card_rect(card_value):
+    """
+    :param card_value: Value of the card
+    :return: the place of a card's face in the atlas
+    :rtype: pygame.Rect
+    """
+    return pygame.Rect(card_value * CARD_WIDTH, 0, CARD_WIDTH, CARD_HEIGHT)
+
+
+def source_files():
+    """
+    :return: the image files the assets are built from
+    :rtype: list
+    """
+    return [CARD_FILE.format(card_value) for card_value in range(NUM_OF_CARDS)] + [BACKGROUND]
+
+
+def decode_images():
+    """
+    decode the image files, scale the cards and pack them into the atlas
+    :return: the atlas and the background
+    :rtype: tuple
+    """
+    atlas = pygame.Surface((NUM_OF_CARDS * CARD_WIDTH, CARD_HEIGHT))
+    for card_value in range(NUM_OF_CARDS):
+        image = pygame.image.load(CARD_FILE.format(card_value))
+        atlas.blit(pygame.transform.scale(image, (CARD_WIDTH, CARD_HEIGHT)), card_rect(card_value))
+    return atlas, pygame.image.load(BACKGROUND)
+
+
+def write_cache(cache_file, atlas, background):
+    """
+    write the raw pixels of the atlas and the background, with a header that describes them
+    the file is replaced at once, so a client that starts meanwhile never reads half of it
+    :param cache_file: the raw asset cache
+    :param atlas: the card faces
+    :param background: the background
+    """
+    width, height = background.get_size()
+    temp_file = cache_file + ".tmp"
+    with open(temp_file, 'wb') as cache:
+        cache.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, NUM_OF_CARDS, CARD_WIDTH, CARD_HEIGHT, width, height))
+        cache.write(pygame.image.tobytes(atlas, PIXEL_FORMAT))
+        cache.write(pygame.image.tobytes(background, PIXEL_FORMAT))
+    os.replace(temp_file, cache_file)
+
+
+def load_cache(cache_file):
+    """
+    memory map the raw asset cache and wrap its pixels in surfaces, without decoding or copying them
+    :param cache_file: the raw asset cache
+    :return: the atlas and the background, None if the cache is missing, invalid or older than an image file
+    :rtype: tuple
+    """
+    try:
+        cache_time = os.path.getmtime(cache_file)
+        if any(os.path.exists(file_name) and os.path.getmtime(file_name) > cache_time for file_name in source_files()):
+            return None
+        with open(cache_file, 'rb') as cache:
+            pixels = mmap.mmap(cache.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(pixels) < CACHE_HEADER.size:
+        return None
+    magic, version, num_of_cards, width, height, background_width, background_height = \
+        CACHE_HEADER.unpack_from(pixels)
+    atlas_size = (num_of_cards * width, height)
+    background_size = (background_width, background_height)
+    atlas_length = atlas_size[0] * atlas_size[1] * BYTES_PER_PIXEL
+    background_length = background_width * background_height * BYTES_PER_PIXEL
+    if (magic, version, num_of_cards, width, height) != (CACHE_MAGIC, CACHE_VERSION, NUM_OF_CARDS, CARD_WIDTH,
+                                                         CARD_HEIGHT) \
+            or len(pixels) != CACHE_HEADER.size + atlas_length + background_length:
+        return None
+    # the surfaces keep the memory views, and the views keep the map open
+    view = memoryview(pixels)
+    atlas = pygame.image.frombuffer(view[CACHE_HEADER.size:CACHE_HEADER.size + atlas_length], atlas_size,
+                                    PIXEL_FORMAT)
+    background = pygame.image.frombuffer(view[CACHE_HEADER.size + atlas_length:], background_size, PIXEL_FORMAT)
+    return atlas, background
+
+
+def build_cache(cache_file=CACHE_FILE):
+    """
+    build step: decode the image files once and write the raw asset cache the clients start from
+    :param cache_file: the raw asset cache
+    """
+    atlas, background = decode_images()
+    write_cache(cache_file, atlas, background)
+    print(f"Wrote {cache_file}: {os.path.getsize(cache_file)} bytes")
+
+
+if __name__ == '__main__':
+    build_cache()
@@ -0,0 +1,342 @@
+"""
+author: Ofri Guz
+Date: 01/06/24
+description: server that handles multiple tables by using asyncio, one coroutine per table
+"""
+import asyncio
+import logging
+import Game
+import Protocol
+import Server
+import State
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# constants
+SERVER_IP = Server.SERVER_IP  # Server IP address
+SERVER_PORT = Server.SERVER_PORT  # Server port number
+HELLO_WAIT = Server.PREFERENCE_WAIT  # Seconds to wait for HEL before a client is seated with the text version
+
+
+class Player:
+    """
+    Connection of a single player, decodes its messages into the inbox of its table
+    """
+    def __init__(self, reader, writer):
+        """
+        Initialize the player
+        :param reader: stream to read the player's messages from
+        :type reader: asyncio.StreamReader
+        :param writer: stream to send messages to the player
+        :type writer: asyncio.StreamWriter
+        """
+        self.reader = reader
+        self.writer = writer
+        self.number = 0  # player number in the table, given when the player is seated
+        self.version = Protocol.TEXT_VERSION  # protocol version agreed with the player
+        self.parser = Protocol.FrameParser()
+
+    def send(self, frame):
+        """
+        send encoded frames to the player, call drain for backpressure
+        :param frame: encoded frames
+        :type frame: bytes
+        """
+        if not self.writer.is_closing():
+            self.writer.write(frame)
+
+    async def drain(self):
+        """
+        wait until the data sent to the player is below the stream's high water mark
+        """
+        try:
+            await self.writer.drain()
+        except ConnectionError as e:
+            logging.info("player " + str(self.number) + " disconnected, " + str(e))
+
+    def hello(self, message):
+        """
+        agree on a protocol version with the player and reply with the agreed version
+        :param message: decoded HEL message
+        """
+        self.version = min(message[1], Protocol.PROTOCOL_VERSION)
+        self.send(Protocol.encode_message(Protocol.TEXT_VERSION, 'HEL', self.version))
+
+    async def handshake(self):
+        """
+        wait for the HEL message a client sends right after connecting, so the player is seated
+        (and dealt) in the agreed version; a client that sends no HEL in HELLO_WAIT keeps the text version
+        :return: payloads of the frames received with HEL, to be handled once the player is seated
+        :rtype: list of bytes
+
+        :raises ConnectionError: If the client disconnected before sending any message
+        :raises ValueError: If the length prefix of a frame is not a number
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + HELLO_WAIT
+        payloads = []
+        try:
+            while not payloads:
+                data = await asyncio.wait_for(self.reader.read(Protocol.READ_SIZE), deadline - loop.time())
+                if not data:
+                    raise ConnectionError("disconnected before sending HEL")
+                payloads = self.parser.feed(data)
+        except asyncio.TimeoutError:
+            logging.info("no HEL message, the player uses the text version")
+            return payloads
+        try:
+            message = Protocol.decode_message(payloads[0])
+        except ValueError:
+            return payloads  # logged with the other invalid messages once the player is seated
+        if message[0] != 'HEL':
+            return payloads
+        self.hello(message)
+        return payloads[1:]
+
+    async def handle_payloads(self, payloads, inbox):
+        """
+        decode received frames, answering HEL and putting every other message in the inbox
+        :param payloads: payloads of complete frames
+        :param inbox: inbox of the player's table
+        :type inbox: asyncio.Queue
+        """
+        for payload in payloads:
+            try:
+                message = Protocol.decode_message(payload)
+            except ValueError as e:
+                logging.error("Invalid message from player " + str(self.number) + ": " + str(e))
+                continue
+            if message[0] == 'HEL':
+                self.hello(message)
+            else:
+                await inbox.put((self, message))
+
+    async def read_messages(self, inbox, payloads=()):
+        """
+        read messages until the player disconnects, answering HEL and putting every other message in the inbox
+        a None message is put in the inbox when the player disconnects
+        :param inbox: inbox of the player's table
+        :type inbox: asyncio.Queue
+        :param payloads: payloads received during the handshake
+        """
+        try:
+            await self.handle_payloads(payloads, inbox)
+            while True:
+                data = await self.reader.read(Protocol.READ_SIZE)
+                if not data:
+                    break
+                await self.handle_payloads(self.parser.feed(data), inbox)
+        except (ConnectionError, ValueError) as e:
+            logging.info("player " + str(self.number) + " disconnected, " + str(e))
+        finally:
+            await inbox.put((self, None))
+
+
+class Table:
+    """
+    Single game, runs the NUM -> DEK -> LOW -> UPD/DON states of Server.main_loop as one coroutine
+    """
+    def __init__(self, num_of_players):
+        """
+        Initialize the table
+        :param num_of_players: number of players needed to start the game
+        :type num_of_players: int
+        """
+        self.num_of_players = num_of_players
+        self.players = []
+        self.inbox = asyncio.Queue()  # (player, message) from every player of the table
+        self.discard_pile = []
+        self.pile_state = Game.PileState()  # effective top of the discard pile
+        self.hands = []  # State.Hand of each player, by player number
+        self.personal_decks = []  # State.PersonalDeck of each player, by player number
+        self.current_player = 0
+        self.connected = 0  # players that did not disconnect yet
+
+    def is_full(self):
+        """
+        check if the table has all of its players
+        :return: True if the game can start
+        :rtype: bool
+        """
+        return len(self.players) == self.num_of_players
+
+    def add_player(self, player):
+        """
+        seat a new player and send it its player number
+        :param player: a player whose handshake was handled
+        :type player: Player
+        """
+        player.number = len(self.players) + 1
+        self.players.append(player)
+        self.connected += 1
+        player.send(Protocol.encode_message(Protocol.TEXT_VERSION, 'NUM', player.number))
+
+    async def broadcast(self, messages):
+        """
+        send messages to all players, every message is serialized once per protocol version
+        :param messages: list of messages (message type followed by its fields)
+        """
+        logging.info("sending to all: " + str(messages))
+        frames = {}  # the messages encoded for each protocol version
+        for player in self.players:
+            frame = frames.get(player.version)
+            if frame is None:
+                frame = b''.join(Protocol.encode_message(player.version, *message) for message in messages)
+                frames[player.version] = frame
+            player.send(frame)
+        await asyncio.gather(*(player.drain() for player in self.players))
+
+    async def next_message(self):
+        """
+        wait for the next message of any player
+        :return: the player and its message
+        :raises ConnectionError: If a player disconnected during the game
+        """
+        player, message = await self.inbox.get()
+        if message is None:
+            self.connected -= 1
+            raise ConnectionError("player " + str(player.number) + " disconnected")
+        return player, message
+
+    async def deal(self):
+        """
+        send every player its deck and pick the starting player by the lowest cards they send back
+        """
+        seed, decks = Server.deal_decks(self.num_of_players)
+        logging.info("table of " + str(self.num_of_players) + " players dealt with seed " + str(seed))
+        self.hands = [State.Hand.from_cards(deck[:Game.HAND_SIZE]) for deck in decks]
+        self.personal_decks = [State.PersonalDeck.from_cards(deck[Game.HAND_SIZE:]) for deck in decks]
+        for player, deck in zip(self.players, decks):
+            player.send(Server.deck_message(player.version, 'DEK', deck))
+        await asyncio.gather(*(player.drain() for player in self.players))
+        lowest_cards = [None] * self.num_of_players
+        while not Server.is_full(lowest_cards):
+            player, message = await self.next_message()
+            if message[0] == 'LOW':
+                lowest_cards[player.number - 1] = message[1]
+        self.current_player = Game.pick_starting_player(lowest_cards)
+        self.current_player = Server.skip_players(self.pile_state, self.hands, self.current_player)[0]
+        logging.info("The starting player is player " + str(self.current_player))
+
+    async def turn(self, player, message):
+        """
+        handle a DON message and send the update to all players
+        :param player: the player that sent the message
+        :param message: decoded message
+        :return: True if the player won
+        :rtype: bool
+        """
+        if message[0] != 'DON' or player.number != self.current_player:
+            logging.info("Received from wrong player")
+            return False
+        new_card_placed, claimed_win, ignore, did_turn = message[1:]
+        result = Server.play_turn(self, player.number, new_card_placed, claimed_win, did_turn)
+        if result is None:
+            return False
+        did_win, new_card, updates = result
+        if did_turn and player.version >= Protocol.DRAW_VERSION:
+            player.send(Server.draw_message(player.version, new_card, len(self.personal_decks[player.number - 1])))
+        if did_win:
+            logging.info('player ' + str(player.number) + " WON!")
+        await self.broadcast(updates)
+        return did_win
+
+    async def play(self):
+        """
+        play the game from dealing until a player wins, then wait for the players to leave
+        """
+        try:
+            await self.deal()
+            await self.broadcast([('UPD', False, self.current_player, Protocol.EMPTY)])
+            did_win = False
+            while not did_win:
+                player, message = await self.next_message()
+                did_win = await self.turn(player, message)
+        except ConnectionError as e:
+            logging.info("table stopped, " + str(e))
+            for player in self.players:
+                player.writer.close()
+        while self.connected > 0:
+            player, message = await self.inbox.get()
+            if message is None:
+                self.connected -= 1
+
+
+class AsyncServer:
+    """
+    Accepts connections and seats them in tables, a table starts as soon as it is full
+    """
+    def __init__(self, num_of_players):
+        """
+        Initialize the server
+        :param num_of_players: number of players in each table
+        :type num_of_players: int
+        """
+        self.num_of_players = num_of_players
+        self.waiting_table = Table(num_of_players)
+        self.tables = set()  # running table tasks
+
+    async def handle_connection(self, reader, writer):
+        """
+        seat a new connection in the waiting table once its handshake was handled, so a full table deals
+        every player in its agreed version, and read its messages until it disconnects
+        :param reader: stream to read the player's messages from
+        :param writer: stream to send messages to the player
+        """
+        peer = writer.get_extra_info('peername')
+        logging.info('received a new connection from ' + str(peer))
+        player = Player(reader, writer)
+        try:
+            payloads = await player.handshake()
+        except (ConnectionError, ValueError) as e:
+            logging.info("client " + str(peer) + " disconnected before it was seated, " + str(e))
+            writer.close()
+            return
+        table = self.waiting_table
+        table.add_player(player)
+        if table.is_full():
+            self.waiting_table = Table(self.num_of_players)
+            task = asyncio.create_task(table.play())
+            self.tables.add(task)
+            task.add_done_callback(self.tables.discard)
+        try:
+            await player.read_messages(table.inbox, payloads)
+        finally:
+            if table is self.waiting_table:
+                # the game did not start, free the seat and send the players after it their new numbers
+                table.players.remove(player)
+                table.connected -= 1
+                for number, waiting_player in enumerate(table.players, start=1):
+                    if waiting_player.number != number:
+                        waiting_player.number = number
+                        waiting_player.send(Protocol.encode_message(Protocol.TEXT_VERSION, 'NUM', number))
+            writer.close()
+
+    async def serve(self):
+        """
+        accept connections forever
+        """
+        server = await asyncio.start_server(self.handle_connection, SERVER_IP, SERVER_PORT, reuse_address=True)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    """
+    gets num of players and runs the server, on uvloop when it is installed
+    """
+    num_of_players = Server.ask_num_of_players()
+    print(f"Number of players set to: {num_of_players}")
+    server = AsyncServer(num_of_players)
+    if uvloop is not None:
+        uvloop.run(server.serve())
+    else:
+        asyncio.run(server.serve())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename="server.log", level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s',)
+    main()
@@ -0,0 +1,259 @@
+"""
+author: Ofri Guz
+Date: 01/06/24
+description: bot player that chooses a card with Monte Carlo tree search over the cards it can not see
+"""
+import math
+import random
+import time
+from collections import Counter
+import Game
+import Matchmaking
+import Protocol
+import Simulator
+import Start
+import State
+
+#  constants
+TIME_BUDGET = 0.2  # Default seconds the bot searches for every move
+EXPLORATION = 1.4  # UCB1 exploration constant
+MAX_NODES = 200000  # Transposition table entries kept between turns before it is cleared
+MAX_TURNS = 1000  # Turns before a simulated game is a draw, like Simulator.MAX_TURNS
+DRAW = 0.5  # Result of a simulated game that no one won
+
+
+class Node:
+    """
+    Decision of the bot in the search tree, shared by every game that reaches the same state
+    """
+    __slots__ = ('visits', 'children')
+
+    def __init__(self):
+        """
+        Initialize the node
+        """
+        self.visits = 0
+        self.children = {}  # card played -> [visits, total result]
+
+    def select(self, valid_cards, rng):
+        """
+        choose the card to try next with UCB1, cards that were never tried come first
+        :param valid_cards: cards the bot may play
+        :param rng: random generator of the search
+        :return: the card
+        :rtype: int
+        """
+        untried = [card for card in valid_cards if card not in self.children]
+        if untried:
+            return rng.choice(untried)
+        log_visits = math.log(self.visits)
+        best_card = None
+        best_score = -1.0
+        for card in valid_cards:
+            visits, total = self.children[card]
+            score = total / visits + EXPLORATION * math.sqrt(log_visits / visits)
+            if score > best_score:
+                best_card = card
+                best_score = score
+        return best_card
+
+    def update(self, card, result):
+        """
+        add the result of a simulated game that played a card from this node
+        :param card: card played
+        :param result: 1 if the bot won, DRAW for a draw and 0 if it lost
+        """
+        self.visits += 1
+        stats = self.children.get(card)
+        if stats is None:
+            self.children[card] = [1, result]
+        else:
+            stats[0] += 1
+            stats[1] += result
+
+
+class Bot:
+    """
+    Information set Monte Carlo tree search player
+    every iteration deals the cards the bot can not see (the other players' hands and decks) at random,
+    then plays the game to the end: the bot's moves come from the tree, the other players and the
+    moves below the tree follow Simulator.lowest_bot
+    the tree is a transposition table keyed on the packed hand, deck and pile, so it is kept between turns
+    """
+    def __init__(self, time_budget=TIME_BUDGET, seed=None, iterations=None):
+        """
+        Initialize the bot
+        :param time_budget: seconds to search for every move
+        :type time_budget: float
+        :param seed: seed of the search, None for a random seed
+        :param iterations: simulated games for every move in place of the time budget, None to search by time;
+        with a seed the bot then always chooses the same cards
+        """
+        self.time_budget = time_budget
+        self.iterations = iterations
+        self.rng = random.Random(seed)
+        self.table = {}  # transposition table, state key -> Node
+        self.played_cards = []  # every card put on the discard pile during the game
+        self.num_of_players = Matchmaking.MIN_PLAYERS  # the highest player number seen
+        self.hidden_deck = False  # True when only the number of cards in the personal deck is known
+
+    def observe_update(self, new_card_placed, player):
+        """
+        keep track of the cards played and the number of players from an UPD message
+        :param new_card_placed: card placed, or EMPTY after a pass
+        :param player: the current player
+        """
+        if new_card_placed != Protocol.EMPTY:
+            self.played_cards.append(new_card_placed)
+        self.num_of_players = max(self.num_of_players, player)
+
+    def state_key(self, hand, deck, pile_state):
+        """
+        get the transposition table key of a decision of the bot
+        the deck is keyed by its length when its cards are hidden
+        :return: the key
+        :rtype: tuple
+        """
+        return (State.Hand.from_cards(sorted(hand)).packed, len(deck) if self.hidden_deck else bytes(deck),
+                State.Pile.from_pile_state(pile_state).rules_key())
+
+    def unseen_cards(self, hand, deck):
+        """
+        get the cards the bot can not see: the full deck without its own cards and the cards played
+        :return: list of cards
+        :rtype: list
+        """
+        unseen = Counter(Start.FULL_DECK)
+        unseen.subtract(hand)
+        unseen.subtract(deck)
+        unseen.subtract(self.played_cards)
+        return list(unseen.elements())
+
+    def choose_card(self, hand, deck, pile_state):
+        """
+        search for the best card to play
+        :param hand: cards in the bot's hand, at least one of them is valid
+        :type hand: list
+        :param deck: cards left in the bot's personal deck, in the order they are drawn,
+        EMPTY for cards the server did not send yet
+        :type deck: list
+        :param pile_state: the discard pile
+        :type pile_state: Game.PileState
+        :return: the card to play
+        :rtype: int
+        """
+        valid_cards = sorted({card for card in hand if pile_state.is_card_valid(card)})
+        if len(valid_cards) == 1:
+            return valid_cards[0]
+        if len(self.table) > MAX_NODES:
+            self.table.clear()
+        known_deck = [card for card in deck if card != Protocol.EMPTY]
+        num_of_hidden = len(deck) - len(known_deck)
+        self.hidden_deck = num_of_hidden > 0
+        unseen = self.unseen_cards(hand, known_deck)
+        dealt = len(Start.FULL_DECK) // self.num_of_players * self.num_of_players
+        num_of_opponents = self.num_of_players - 1
+        opponent_cards = max(0, dealt - len(self.played_cards) - len(hand) - len(deck)) // num_of_opponents
+        root_pile = State.Pile.from_pile_state(pile_state)
+        root_key = self.state_key(hand, deck, pile_state)
+        deadline = time.monotonic() + self.time_budget
+        iteration = 0
+        while self.keep_searching(iteration, deadline):
+            iteration += 1
+            self.rng.shuffle(unseen)
+            hands = [list(hand)]
+            # the hidden cards of the bot's deck are dealt from the unseen cards like the opponents' cards
+            decks = [known_deck + unseen[:num_of_hidden]]
+            for i in range(num_of_opponents):
+                cards = unseen[num_of_hidden + i * opponent_cards:num_of_hidden + (i + 1) * opponent_cards]
+                hands.append(cards[:Game.HAND_SIZE])
+                decks.append(cards[Game.HAND_SIZE:])
+            self.iterate(hands, decks, root_pile.pile_state())
+        root = self.table.get(root_key)
+        if root is None:
+            return self.rng.choice(valid_cards)
+        return max(valid_cards, key=lambda card: root.children.get(card, (0, 0))[0])
+
+    def keep_searching(self, iteration, deadline):
+        """
+        :param iteration: simulated games played for this move
+        :param deadline: end of the time budget
+        :return: True while the bot has iterations or time left to search
+        :rtype: bool
+        """
+        if self.iterations is not None:
+            return iteration < self.iterations
+        return time.monotonic() < deadline
+
+    def iterate(self, hands, decks, pile_state):
+        """
+        play a single simulated game from the bot's turn and add its result to the tree
+        :param hands: hand of every player, the bot first
+        :param decks: personal deck of every player, the bot first
+        :param pile_state: the discard pile
+        """
+        path = []  # (node, card) of every decision of the bot in the tree
+        in_tree = True
+        winner = None
+        current_player = 0
+        for turn in range(MAX_TURNS):
+            hand = hands[current_player]
+            if not pile_state.have_valid_card(hand):
+                pile_state.reset()
+            else:
+                if current_player == 0 and in_tree:
+                    key = self.state_key(hand, decks[0], pile_state)
+                    node = self.table.get(key)
+                    if node is None:
+                        # expand a single node and play the rest of the game without the tree
+                        node = Node()
+                        self.table[key] = node
+                        in_tree = False
+                    card = node.select(sorted({card for card in hand if pile_state.is_card_valid(card)}), self.rng)
+                    path.append((node, card))
+                else:
+                    card = Simulator.lowest_bot(hand, pile_state, self.rng)
+                pile_state.push(card)
+                hand.remove(card)
+                deck = decks[current_player]
+                if deck:
+                    hand.append(deck.pop(0))
+                elif not hand:
+                    winner = current_player
+                    break
+            current_player = (current_player + 1) % len(hands)
+        result = DRAW if winner is None else float(winner == 0)
+        for node, card in path:
+            node.update(card, result)
+
+    def choose_position(self, hand, deck, pile_state):
+        """
+        choose a card like a mouse click on it
+        :return: position of the card in the hand (1 for the first card), as Client.press_on_card expects
+        :rtype: int
+        """
+        return hand.index(self.choose_card(hand, deck, pile_state)) + 1
+
+
+if __name__ == '__main__':
+    # Assertions
+
+    # Check if the bot chooses a card of its hand that is valid on the pile
+    test_hand = [1, 5, 9]
+    test_deck = [2, 3, 4, 6, 7, 8]
+    card = Bot(seed=7, iterations=100).choose_card(test_hand, test_deck, Game.PileState())
+    assert card in test_hand and Game.PileState().is_card_valid(card)
+
+    # Check if the only valid card is played without searching
+    bot = Bot(seed=7, iterations=100)
+    assert bot.choose_card([1, 2, 9], test_deck, Game.PileState([9])) == 9 and not bot.table
+
+    # Check if the same seed and number of iterations always choose the same card from the same tree
+    first, second = Bot(seed=7, iterations=200), Bot(seed=7, iterations=200)
+    assert first.choose_card(test_hand, test_deck, Game.PileState()) == \
+        second.choose_card(test_hand, test_deck, Game.PileState())
+    assert {key: node.children for key, node in first.table.items()} == \
+        {key: node.children for key, node in second.table.items()}
+
+    # Check if the position of the card chosen starts from 1, like a click on the first card
+    assert Bot(seed=7, iterations=100).choose_position([1, 2, 9], test_deck, Game.PileState([9])) == 3
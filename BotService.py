@@ -0,0 +1,292 @@
+"""
+author: Ofri Guz
+Date: 01/06/24
+description: runs the moves of server side bots in a pool of processes, so searching never blocks the server loop
+"""
+import logging
+import multiprocessing
+import random
+import socket
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import Bot
+import Game
+import Protocol
+import Simulator
+import State
+
+#  constants
+NUM_OF_WORKERS = 2  # Default number of bot processes of a server process, small since every server process has its own
+MOVE_DEADLINE = 1.0  # Seconds a bot has to choose a move before the fallback move is played for it
+TIME_BUDGET = 0.2  # Seconds a bot searches for every move, well below the deadline
+
+# global variables
+worker_bots = {}  # bot of each number of players in a worker process, kept so the search tree is reused
+
+
+def choose_card(hand, deck, pile, played_cards, num_of_players, time_budget):
+    """
+    worker task, search for the card a bot plays
+    :param hand: cards in the bot's hand
+    :param deck: cards left in the bot's personal deck
+    :param pile: packed discard pile
+    :type pile: int
+    :param played_cards: every card played during the game
+    :param num_of_players: number of players in the game
+    :param time_budget: seconds to search
+    :return: the card to play
+    :rtype: int
+    """
+    bot = worker_bots.get(num_of_players)
+    if bot is None:
+        bot = Bot.Bot(time_budget)
+        worker_bots[num_of_players] = bot
+    bot.time_budget = time_budget
+    bot.played_cards = played_cards
+    bot.num_of_players = num_of_players
+    return bot.choose_card(hand, deck, State.Pile(pile).pile_state())
+
+
+class BotSeat:
+    """
+    Seat of a bot in a room, plays like Client: answers DEK with LOW and UPD with DON
+    every message of the bot goes back to the room through the service, from the server loop
+    """
+    def __init__(self, service, room, number):
+        """
+        Initialize the seat
+        :param service: the service that runs the bot's moves
+        :type service: BotService
+        :param room: room of the seat
+        :param number: player number of the bot
+        :type number: int
+        """
+        self.service = service
+        self.room = room
+        self.number = number
+        self.hand = []
+        self.deck = []
+        self.pile_state = Game.PileState()
+        self.played_cards = []  # every card played during the game
+        self.active = True  # False once the game ended or the room closed
+
+    def receive_deck(self, deck):
+        """
+        take the first cards of the personal deck into the hand and send the lowest card
+        :param deck: the bot's personal deck
+        """
+        self.hand = list(deck[:Game.HAND_SIZE])
+        self.deck = list(deck[Game.HAND_SIZE:])
+        self.service.post(self, ('LOW', Simulator.lowest_card(self.hand), False, self.number, True))
+
+    def handle_updates(self, messages):
+        """
+        follow the UPD messages sent to the players and play when it is the bot's turn
+        :param messages: list of decoded UPD messages
+        """
+        current_player = None
+        for msg_type, did_win, player, new_card_placed in messages:
+            if did_win:
+                self.leave()
+                return
+            if new_card_placed == Protocol.EMPTY:
+                self.pile_state.reset()
+            else:
+                self.pile_state.push(new_card_placed)
+                self.played_cards.append(new_card_placed)
+            current_player = player
+        if current_player == self.number and self.active:
+            if self.pile_state.have_valid_card(self.hand):
+                self.service.request_move(self)
+            else:
+                self.service.post(self, ('DON', Protocol.EMPTY, False, self.number, False))
+
+    def play(self, card):
+        """
+        play a card from the hand, draw from the personal deck and send the DON message
+        :param card: a valid card in the hand
+        """
+        self.hand.remove(card)
+        if self.deck:
+            self.hand.append(self.deck.pop(0))
+        self.service.post(self, ('DON', card, not self.hand, self.number, True))
+
+    def fallback_card(self):
+        """
+        the cheap move played when the search misses its deadline
+        :return: the card to play
+        """
+        return Simulator.lowest_bot(self.hand, self.pile_state, self.service.rng)
+
+    def leave(self):
+        """
+        stop playing, a move that is still searched is dropped
+        """
+        self.active = False
+        self.service.cancel(self)
+
+
+class BotService:
+    """
+    Sends the moves of the bots to a process pool and feeds the chosen cards back into the server loop
+    the pool wakes the loop through a socket pair registered in its selector, and a move that misses
+    its deadline is replaced by the fallback move
+    """
+    def __init__(self, num_of_workers=NUM_OF_WORKERS, deadline=MOVE_DEADLINE, time_budget=TIME_BUDGET):
+        """
+        Initialize the service
+        :param num_of_workers: number of bot processes
+        :param deadline: seconds a bot has to choose a move
+        :param time_budget: seconds a bot searches for every move
+        """
+        self.deadline = deadline
+        self.time_budget = time_budget
+        # spawned and not forked, so the bot processes do not hold copies of the server's sockets
+        self.executor = ProcessPoolExecutor(num_of_workers, mp_context=multiprocessing.get_context('spawn'))
+        self.rng = random.Random()
+        self.wakeup_socket, self.notify_socket = socket.socketpair()
+        self.wakeup_socket.setblocking(False)
+        self.notify_socket.setblocking(False)
+        self.pending = {}  # (deadline, future) of the move each seat waits for
+        self.finished = deque()  # (seat, future) of moves the pool finished, appended by the pool's thread
+        self.messages = deque()  # (seat, message) waiting to be handled by the seat's room
+
+    def seat(self, room, number):
+        """
+        create the seat of a bot
+        :param room: room of the seat
+        :param number: player number of the bot
+        :return: the seat
+        :rtype: BotSeat
+        """
+        return BotSeat(self, room, number)
+
+    def wake(self):
+        """
+        make the server loop's selector return, to handle the finished moves and the messages
+        """
+        try:
+            self.notify_socket.send(b'\0')
+        except BlockingIOError:
+            pass  # the loop was already woken up
+
+    def post(self, seat, message):
+        """
+        queue a message of a bot for its room
+        :param seat: the bot's seat
+        :param message: decoded message, as a client would send it
+        """
+        self.messages.append((seat, message))
+        self.wake()
+
+    def request_move(self, seat):
+        """
+        send the search of a bot's move to the pool
+        :param seat: the bot's seat
+        """
+        try:
+            future = self.executor.submit(choose_card, list(seat.hand), list(seat.deck),
+                                          State.Pile.from_pile_state(seat.pile_state).packed,
+                                          list(seat.played_cards), seat.room.num_of_players, self.time_budget)
+        except Exception as e:
+            # a broken pool must not stop the server loop, the bot plays the fallback move instead
+            logging.error("bot " + str(seat.number) + " could not search for a move: " + str(e))
+            seat.play(seat.fallback_card())
+            return
+        self.pending[seat] = (time.monotonic() + self.deadline, future)
+        future.add_done_callback(lambda done: self.move_done(seat, done))
+
+    def move_done(self, seat, future):
+        """
+        called by the pool's thread when a move is found
+        :param seat: the bot's seat
+        :param future: the finished search
+        """
+        self.finished.append((seat, future))
+        self.wake()
+
+    def cancel(self, seat):
+        """
+        drop the move a seat waits for
+        :param seat: the bot's seat
+        """
+        deadline, future = self.pending.pop(seat, (None, None))
+        if future is not None:
+            future.cancel()
+
+    def next_deadline(self):
+        """
+        :return: the earliest deadline of the moves being searched, None if no move is searched
+        :rtype: float
+        """
+        return min((deadline for deadline, future in self.pending.values()), default=None)
+
+    def expire(self, now):
+        """
+        play the fallback move of every bot that missed its deadline
+        :param now: current time
+        """
+        for seat, (deadline, future) in list(self.pending.items()):
+            if deadline <= now:
+                logging.warning("bot " + str(seat.number) + " missed its deadline, playing the fallback move")
+                self.cancel(seat)
+                seat.play(seat.fallback_card())
+
+    def handle_events(self, wakeup_socket, events):
+        """
+        selector handler of the wakeup socket, plays the finished moves and hands the bots' messages to their rooms
+        :param wakeup_socket: the service's wakeup socket
+        :param events: the selector events that are ready
+        """
+        try:
+            while wakeup_socket.recv(Protocol.READ_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+        while self.finished:
+            seat, future = self.finished.popleft()
+            if self.pending.get(seat, (None, None))[1] is not future:
+                continue  # the move was late or dropped, the fallback move was already played
+            del self.pending[seat]
+            try:
+                card = future.result()
+            except Exception as e:
+                logging.error("bot " + str(seat.number) + " failed to choose a move: " + str(e))
+                card = seat.fallback_card()
+            seat.play(card)
+        while self.messages:
+            seat, message = self.messages.popleft()
+            if seat.active:
+                seat.room.handle_client_message(seat, message)
+
+    def close(self):
+        """
+        stop the pool and close the wakeup sockets
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.wakeup_socket.close()
+        self.notify_socket.close()
+
+
+if __name__ == '__main__':
+    # Assertions
+    service = BotService(num_of_workers=1)
+    seat = service.seat(None, 2)
+    seat.receive_deck([1, 2, 9, 5, 6])
+    assert seat.hand == [1, 2, 9] and seat.deck == [5, 6]
+
+    # Check if the fallback move is a valid card of the hand, the lowest number card when there is one
+    seat.pile_state = Game.PileState([9])
+    assert seat.fallback_card() == 9
+    seat.pile_state = Game.PileState()
+    assert seat.fallback_card() == 1
+
+    # Check if a move that is still searched after its deadline is replaced by the fallback move
+    service.pending[seat] = (10.0, Future())
+    service.expire(9.0)
+    assert seat in service.pending and seat.hand == [1, 2, 9]
+    service.expire(10.0)
+    assert seat not in service.pending and seat.hand == [2, 9, 5] and seat.deck == [6]
+    assert service.messages[-1] == (seat, ('DON', 1, False, 2, True))
+    service.close()
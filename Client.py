@@ -3,11 +3,13 @@ author: Ofri Guz
 Date: 01/06/24
 description: client which connects to server
 """
+import queue
 import socket
 import threading
 import time
 import traceback
 import pygame
+import Bot
 import Game
 import GUI
 import Protocol
@@ -18,7 +20,13 @@ import Welcome
 MAX_PACKET = 1024  # Maximum size of packet to be received
 IP = '127.0.0.1'  # Server IP address
 PORT = 8820  # Server port number
+TABLE_SIZE = Protocol.ANY_TABLE_SIZE  # Preferred number of players in a table (2 to 4), or any
+BOT_PLAYER = False  # True to let the search bot choose the cards instead of the mouse
+BOT_TIME_BUDGET = Bot.TIME_BUDGET  # Seconds the bot searches for every move
 SEPERATOR = '$'  # Separator used in messages
+STOP_SENDING = None  # Put in waiting_to_send to stop the sender thread once the messages before it are sent
+SENDER_JOIN_TIMEOUT = 2  # Seconds stop_connection waits for the sender thread to send what is left
+UI_BUDGET = 0.5 / GUI.REFRESH_RATE  # Seconds of every frame spent on server messages, the rest is input and drawing
 CARD_WIDTH = 120  # Width of a card
 CARD_HEIGHT = 150  # Height of a card
 CARD_PLACE_ROW = 400  # Row position where cards are placed
@@ -36,37 +44,29 @@ runs = True  # Flag to control the main loop
 gui: GUI.GUI  # GUI instance
 discard_pile = []  # List to store cards in the discard pile
 saved_discard = []  # List to store saved discarded cards
-game: Game.GAME  # Game instance
+pile_state = Game.PileState()  # Effective top of the discard pile, updated with every card played
 your_turn = False  # Flag to indicate if it's the player's turn
-waiting_to_send = []  # List of messages waiting to be sent to the server
+waiting_to_send = queue.Queue()  # Messages waiting to be sent to the server, the sender thread sleeps on it
+sender_thread = None  # Thread that sends the messages waiting to be sent
+ui_commands = queue.Queue()  # Decoded server messages, posted by the network thread and handled by the main loop
 client_socket: socket.socket  # Client socket
 current_deck = []  # List to store the current deck
 game_state = None  # Variable to store the current state of the game
 welcome_page: Welcome.WelcomePage
+protocol_version = Protocol.TEXT_VERSION  # protocol version agreed with the server
+bot = Bot.Bot(BOT_TIME_BUDGET) if BOT_PLAYER else None  # search bot that plays instead of the mouse
 
 
-def receive_deck(message_str):
+def receive_deck(message):
     """
         Receives the deck from the server message
-        :param message_str: String message from the server
+        :param message: decoded message from the server
         :return: List of integers representing the deck
     """
     try:
-        # Check if the message is empty
-        if not message_str:
-            raise ValueError("Received empty message from server")
-
-        # Check if the message starts with '$'
-        if not message_str.startswith('DEK$'):
-            raise ValueError("Invalid message format: Message does not start with 'DECKS$'")
-        # Remove the leading '$' character
-        message_str = message_str[4:]
-        # Convert the string back into a list of integers
-        if message_str:
-            message_list = list(map(int, message_str.split(SEPERATOR)))
-        else:
-            message_list = []
-        return message_list
+        if message[0] != 'DEK':
+            raise ValueError("Invalid message format: Message is not a DEK message")
+        return message[1]
     except Exception as e:
         logging.error("Error receiving deck: %s", e)
         raise
@@ -89,26 +89,6 @@ def hand_out_cards(deck):
     return removed, deck
 
 
-def send_message(my_socket, msg_type, current_card, did_win, player, did_turn):
-    """
-    sends message to server
-    :param my_socket: Socket to send the message through
-    :param msg_type: message type
-    :param current_card: Card played
-    :param did_win: Whether the player won the game
-    :param player: Number Player
-    :param did_turn: Whether the player did a move
-    :return:
-    """
-    try:
-        message = f"{msg_type}${current_card}${did_win}${player}${did_turn}"
-        msg = Protocol.protocol_client_send(message)
-        logging.info('Sending message: %s', msg)
-        my_socket.send(msg.encode())
-    except Exception as e:
-        logging.error("Error sending message: %s", e)
-
-
 def add_to_waiting_list(msg_type, current_card, did_win, player, did_turn):
     """
     Add message to waiting to send list
@@ -118,10 +98,9 @@ def add_to_waiting_list(msg_type, current_card, did_win, player, did_turn):
     :param player: Number Player
     :param did_turn: Whether the player did a move
     """
-    global waiting_to_send
-    message = f"{msg_type}${current_card}${did_win}${player}${did_turn}"
+    message = (msg_type, current_card, did_win, player, did_turn)
     logging.info('waiting to send %s', message)
-    waiting_to_send.append(message)
+    waiting_to_send.put(message)
 
 
 def lowest_card(cards_in_hand):
@@ -137,70 +116,69 @@ def lowest_card(cards_in_hand):
     return lowest_card_value  # if equal to 15 means no yellow cards
 
 
-def receive_update(message_str):
+def receive_update(message):
     """
     Receive update message
-    :param message_str: message from server
+    :param message: decoded message from server
     :return: components of update message -
     :return: new_card_placed: new card played did_win_bool: whether the game ended, player: current player
     """
-    # Check if the message is empty
-    if not message_str:
-        raise ValueError("Received empty message from server")
+    logging.info('received message %s', message)
 
-    logging.info('received message %s', message_str)
+    if message[0] != 'UPD':
+        raise ValueError("Invalid message format: Message is not an UPD message")
 
-    # Check if the message starts with '$'
-    if not message_str.startswith('UPD$'):
-        raise ValueError("Invalid message format: Message does not start with 'DON$'")
+    did_win_bool, player, new_card_placed = message[1:]
+    return new_card_placed, did_win_bool, player
 
-    # Remove the leading '$' character
-    message_str = message_str[4:]
 
-    # Convert the string back into a list of integers
-    did_win, player, new_card_placed, = message_str.split(SEPERATOR)
-    did_win_bool = True
-    if did_win == "False":
-        did_win_bool = False
-    return new_card_placed, did_win_bool, int(player)
+def take_waiting_messages():
+    """
+    Sleeps until a message is waiting to be sent, then takes every message waiting
+    :return: List of messages, ending with STOP_SENDING if the sender should stop
+    """
+    messages = [waiting_to_send.get()]
+    try:
+        while messages[-1] is not STOP_SENDING:
+            messages.append(waiting_to_send.get_nowait())
+    except queue.Empty:
+        pass
+    return messages
 
 
 def handle_client_messages():
     """
     Handles messages that need to be sent to the server
+    sleeps until messages are added to waiting_to_send and sends all of them in one sendall,
+    until stop_connection puts STOP_SENDING
     """
     global client_socket
-    global waiting_to_send
     while True:
-        try:
-            if waiting_to_send is not None and len(waiting_to_send) > 0:
-                for message_to_send in waiting_to_send:
-                    try:
-                        message = Protocol.protocol_client_send(message_to_send)
-                        logging.info('message sending to server: %s', message)
-                        print("Message sending to server:", message)
-                        client_socket.send(message.encode())
-                        waiting_to_send.remove(message_to_send)
-                    except Exception as e:
-                        logging.error("Error in sending message loop: %s", e)
-                        time.sleep(5)
-        except Exception as e:
-            stack_trace = traceback.format_exc()
-            print(stack_trace)
-            print(f"Error handling client messages: {e}")
-            time.sleep(5)  # Sleep for 5 seconds
+        messages = take_waiting_messages()
+        stop = messages[-1] is STOP_SENDING
+        if stop:
+            messages.pop()
+        if messages:
+            try:
+                logging.info('messages sending to server: %s', messages)
+                print("Messages sending to server:", messages)
+                client_socket.sendall(b''.join(Protocol.encode_message(protocol_version, *message_to_send)
+                                               for message_to_send in messages))
+            except Exception as e:
+                stack_trace = traceback.format_exc()
+                print(stack_trace)
+                logging.error("Error sending messages to server: %s", e)
+        if stop:
+            break
 
 
 def handle_server_connection():
     """
-    Handles the connection to the server and processes incoming messages
+    Handles the connection to the server and receives incoming messages
+    runs on its own thread, so it only decodes the messages and posts them to ui_commands
+    for the main loop, which owns the GUI
     """
     global runs
-    global gui
-    global discard_pile
-    global saved_discard
-    global game
-    global your_turn
     global client_socket
 
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -210,6 +188,9 @@ def handle_server_connection():
             client_socket.connect((IP, PORT))
             print("Connected to server")
             logging.info('Connected to server')
+            # ask for the newest protocol version, the server answers with the version it agrees to
+            client_socket.send(Protocol.encode_message(Protocol.TEXT_VERSION, 'HEL', Protocol.PROTOCOL_VERSION))
+            client_socket.send(Protocol.encode_message(Protocol.TEXT_VERSION, 'SIZ', TABLE_SIZE))
             break
         except Exception as e:
             print(f"Error connecting to server: {e}")
@@ -218,31 +199,10 @@ def handle_server_connection():
         try:
             print("waiting to receive message from the server")
             logging.info("waiting to receive message from the server")
-            data = Protocol.protocol_receive(client_socket)
+            data = Protocol.receive_message(client_socket)
             print("Received from server:", data)
             logging.info("Received from server: %s", data)
-            if data.startswith('NUM$'):
-                handle_num_message(data)
-
-            elif data.startswith('DEK$'):
-                deck = receive_deck(data)
-                cards_in_hand, deck = hand_out_cards(deck)
-                send_message(client_socket, 'LOW', lowest_card(cards_in_hand), False, gui.get_player_num(), True)
-                print("Cards in hand:", cards_in_hand)
-                print("Remaining deck:", deck)
-                if gui is None:
-                    print("GUI IS NONE")
-                    logging.info("GUI IS NONE")
-                else:
-                    gui.set_deck(deck)
-                    print(gui.get_deck())
-                    gui.set_removed_cards(cards_in_hand)
-                    gui.print_cards(game_state)
-            elif data.startswith("UPD$"):
-                handle_update_message(data)
-            else:
-                print("Unexpected message")
-                logging.warning("Unexpected message")
+            ui_commands.put(data)
         except ConnectionResetError as e:
             logging.error(f"Connection was reset: %s", e)
             raise
@@ -252,53 +212,146 @@ def handle_server_connection():
             logging.error("Error receiving data from server: %s", e)
 
 
+def handle_server_message(data):
+    """
+    Handles a message from the server, on the main loop
+    :param data: decoded message from the server
+    """
+    if data[0] == 'HEL':
+        handle_hello_message(data)
+    elif data[0] == 'NUM':
+        handle_num_message(data)
+    elif data[0] == 'DEK':
+        handle_deck_message(data)
+    elif data[0] == 'UPD':
+        handle_update_message(data)
+    elif data[0] == 'DRW':
+        handle_draw_message(data)
+    else:
+        print("Unexpected message")
+        logging.warning("Unexpected message")
+
+
+def handle_ui_commands(budget):
+    """
+    Handles the messages posted by the network thread, until none is left or the budget of the frame is spent
+    the messages left are handled in the next frames
+    :param budget: seconds to spend
+    """
+    deadline = time.monotonic() + budget
+    while time.monotonic() < deadline:
+        try:
+            data = ui_commands.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            handle_server_message(data)
+        except Exception as e:
+            stack_trace = traceback.format_exc()
+            print(stack_trace)
+            logging.error("Error handling message from server: %s", e)
+
+
+def handle_hello_message(data):
+    """
+    Handles the HEL message from the server, switching to the protocol version it agreed to
+    :param data: decoded message from the server
+    """
+    global protocol_version
+    protocol_version = data[1]
+    logging.info("Using protocol version %s", protocol_version)
+
+
 def handle_num_message(data):
     """
     Handles the NUM message from the server, setting the player number
-    :param data: String message from the server
+    :param data: decoded message from the server
     """
     global gui, welcome_page
-    player_num = data[4:]
+    player_num = data[1]
     if gui is None:
         print("GUI IS NONE")
         logging.info("GUI IS NONE")
     else:
-        player_num = int(player_num)
         gui.set_player_num(player_num)
         gui.draw_player_number(player_num)
 
 
+def handle_deck_message(data):
+    """
+    Handles the DEK message from the server, taking the cards in hand and sending the lowest card
+    :param data: decoded message from the server
+    """
+    global gui
+    deck = receive_deck(data)
+    if protocol_version >= Protocol.DRAW_VERSION:
+        # only the hand is dealt, the DRW message that follows tells how many cards are left
+        cards_in_hand, deck = list(deck), []
+    else:
+        cards_in_hand, deck = hand_out_cards(list(deck))
+    add_to_waiting_list('LOW', lowest_card(cards_in_hand), False, gui.get_player_num(), True)
+    print("Cards in hand:", cards_in_hand)
+    print("Remaining deck:", deck)
+    if gui is None:
+        print("GUI IS NONE")
+        logging.info("GUI IS NONE")
+    else:
+        gui.set_deck(deck)
+        print(gui.get_deck())
+        gui.set_removed_cards(cards_in_hand)
+        gui.print_cards(game_state)
+
+
+def handle_draw_message(data):
+    """
+    Handles the DRW message from the server, the card drawn from the personal deck the server holds
+    :param data: decoded message from the server
+    """
+    global gui
+    new_card, cards_left = data[1:]
+    if new_card != Protocol.EMPTY:
+        # the card played was already taken out of the hand, the new card takes its place
+        gui.set_removed_cards(gui.get_removed_cards() + [new_card])
+        gui.draw_new_card(gui.get_card_pressed())
+        print("updated order: cards in hand:", gui.get_removed_cards())
+    # the cards of the deck are not known, only how many are left
+    gui.set_deck([Protocol.EMPTY] * cards_left)
+
+
 def handle_update_message(data):
     """
     Handles the UPDATE message from the server
-    :param data: String message from the server
+    :param data: decoded message from the server
     """
-    global discard_pile, game, your_turn, saved_discard, gui, client_socket
+    global discard_pile, pile_state, your_turn, saved_discard, gui, client_socket
     new_card_placed, did_win, player = receive_update(data)
-    print("Current player: " + str(player) + " New card placed: " + new_card_placed)
+    print("Current player: " + str(player) + " New card placed: " + str(new_card_placed))
     gui.draw_current_player(player)
     player = int(player)
-    if new_card_placed == "EMPTY":
+    if bot is not None:
+        bot.observe_update(new_card_placed, player)
+    if new_card_placed == Protocol.EMPTY:
         gui.redo()
         discard_pile = []
+        pile_state.reset()
     else:
-        new_card_placed = int(new_card_placed)
         gui.draw_middle(new_card_placed)
         discard_pile.append(new_card_placed)  # double check not adding twice
+        pile_state.push(new_card_placed)
     print("Discard pile:", discard_pile, "Current Player:", player, "Player Num:", gui.get_player_num())
     if int(player) == gui.get_player_num() and did_win is False:
-        game = Game.GAME(discard_pile, 0, gui.get_removed_cards())
-        print("Are cards valid?", game.have_valid_card())
-        if not game.have_valid_card():
+        have_valid_card = pile_state.have_valid_card(gui.get_removed_cards())
+        print("Are cards valid?", have_valid_card)
+        if not have_valid_card:
             your_turn = False
             gui.display_message("No Valid Card")
             if discard_pile:
                 saved_discard += discard_pile
-            last_card = "EMPTY"
+            last_card = Protocol.EMPTY
             gui.create_screen()
             gui.print_cards(game_state)
             gui.draw_player_number(gui.get_player_num())
-            send_message(client_socket, "DON", last_card, False, gui.get_player_num(), False)
+            add_to_waiting_list("DON", last_card, False, gui.get_player_num(), False)
         else:
             your_turn = True
     else:
@@ -306,7 +359,7 @@ def handle_update_message(data):
     if did_win is True:
         print("Player " + str(player) + " won!!")
         logging.info("Player " + str(player) + " won!!")
-        gui.display_message("Player " + str(player) + " won!!")
+        gui.display_message("Player " + str(player) + " won!!", None)
 
 
 def start_connection():
@@ -316,9 +369,10 @@ def start_connection():
     connection_thread = threading.Thread(target=handle_server_connection)
     connection_thread.daemon = True  # This makes the thread exit when the main program exits
     connection_thread.start()
-    connection_thread_client_messages = threading.Thread(target=handle_client_messages)
-    connection_thread_client_messages.daemon = True  # This makes the thread exit when the main program exits
-    connection_thread_client_messages.start()
+    global sender_thread
+    sender_thread = threading.Thread(target=handle_client_messages)
+    sender_thread.daemon = True  # This makes the thread exit when the main program exits
+    sender_thread.start()
 
 
 def main():
@@ -328,7 +382,6 @@ def main():
 
     global gui, welcome_page
     global your_turn
-    global game
     try:
         open_gui("", "", 1)
         if gui is None:
@@ -366,6 +419,13 @@ def main():
                             for i, button_rect in enumerate(BUTTONS, start=1):
                                 if button_rect.collidepoint(place):
                                     press_on_card(i)
+                handle_ui_commands(UI_BUDGET)
+                if bot is not None and your_turn:
+                    # the bot presses on the card it chose, like a mouse click on it
+                    press_on_card(bot.choose_position(gui.get_removed_cards(), gui.get_deck(), pile_state))
+                # everything drawn during the frame is pushed to the display at once
+                gui.present()
+                GUI.CLOCK.tick(GUI.REFRESH_RATE)
             except Exception as e:
                 logging.error(f"Error in main event loop: {e}")
     except Exception as e:
@@ -381,7 +441,7 @@ def press_on_card(card_position):
     :param card_position: Position of the card pressed
     """
     global gui
-    global game, your_turn, current_deck, game_state
+    global your_turn, current_deck, game_state
 
     try:
         print(f"Pressed Card position :  {card_position}")
@@ -389,10 +449,10 @@ def press_on_card(card_position):
         gui.set_card_pressed(card_position)
         card_value = gui.get_removed_cards()[gui.get_card_pressed() - 1]
         print(f"card value:  {card_value}")
-        game = Game.GAME(discard_pile, card_value, gui.get_removed_cards())
-        print("Is card valid?", game.is_card_valid())
+        is_card_valid = pile_state.is_card_valid(card_value)
+        print("Is card valid?", is_card_valid)
 
-        if game.is_card_valid():
+        if is_card_valid:
             gui.move_to_middle(gui.get_removed_cards(), gui.get_card_pressed())
             # next_card = gui.replace_chosen_card(gui.get_card_pressed(), gui.get_removed_cards())
             current_deck = gui.get_deck()
@@ -400,7 +460,12 @@ def press_on_card(card_position):
 
             # gui.set_removed_cards(next_card)
             print("cards in hand:", gui.get_removed_cards())
-            if current_deck:
+            if current_deck and protocol_version >= Protocol.DRAW_VERSION:
+                # the server sends the card drawn in a DRW message
+                hand = gui.get_removed_cards()
+                gui.set_removed_cards(hand[:gui.get_card_pressed() - 1] + hand[gui.get_card_pressed():])
+                add_to_waiting_list("DON", card_value, False, gui.get_player_num(), True)
+            elif current_deck:
                 next_card = gui.replace_chosen_card(gui.get_card_pressed(), gui.get_removed_cards())
                 gui.set_removed_cards(next_card)
                 gui.draw_new_card(gui.get_card_pressed())
@@ -441,9 +506,13 @@ def press_on_card(card_position):
 def stop_connection():
     """
     Stops the connection to the server
+    the sender thread sends the messages that are still waiting and stops
     """
     global runs
     runs = False
+    waiting_to_send.put(STOP_SENDING)
+    if sender_thread is not None:
+        sender_thread.join(SENDER_JOIN_TIMEOUT)
 
 
 def open_gui(cards_in_hand, deck, player_number):
@@ -5,6 +5,7 @@ description: GUI class that handles graphics
 """
 import pygame
 import sys
+import Assets
 import Welcome
 
 #  constants
@@ -14,11 +15,11 @@ ZERO = 0
 CARD_WIDTH = 120  # Width of a card
 CARD_HEIGHT = 150  # Height of a card
 REFRESH_RATE = 60
+MESSAGE_TIME = 1000  # Milliseconds a message stays on the screen
 CLOCK = pygame.time.Clock()
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 FONT = "Comic Sans MS"
-BACKGROUND = "background.jpg"
 CARD_ZERO = "card_0.jpg"
 CARD_ONE = "card_1.jpg"
 CARD_TWO = "card_2.jpg"
@@ -36,6 +37,13 @@ DISCARD_PILE_PLACE_COLUMN = 200
 CARD_PLACE_ROW = 400
 SCREEN_WIDTH = 900
 SCREEN_HEIGHT = 600
+# regions of the screen that are pushed to the display when they are drawn
+SCREEN_RECT = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+HAND_RECT = pygame.Rect(250, CARD_PLACE_ROW, 530 + CARD_WIDTH - 250, CARD_HEIGHT)  # every layout of the hand
+DISCARD_PILE_RECT = pygame.Rect(DISCARD_PILE_PLACE_ROW, DISCARD_PILE_PLACE_COLUMN, CARD_WIDTH, CARD_HEIGHT)
+DECK_COUNTER_RECT = pygame.Rect(30, CARD_PLACE_ROW, CARD_WIDTH, CARD_HEIGHT)
+PLAYER_NUMBER_RECT = pygame.Rect(10, 10, 200, 50)
+CURRENT_PLAYER_RECT = pygame.Rect(10, 70, 200, 50)
 
 
 class GUI:
@@ -56,6 +64,7 @@ class GUI:
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         self.player_num = player_num
         pygame.display.set_caption("8 1/2")
+        self.assets = Assets.Assets()  # card images and background, decoded and scaled once
         self.removed_cards = removed_cards
         self.buttons = [
             pygame.Rect(250, CARD_PLACE_ROW, CARD_WIDTH, CARD_HEIGHT),
@@ -68,6 +77,10 @@ class GUI:
         self.discard_pile = discard_pile
         self.card_value = None
         self.bank = [None] * len(self.removed_cards)
+        self.dirty_rects = []  # regions drawn since the last frame was presented
+        self.message = None  # (surface, position) of each layer of the message shown over the screen
+        self.message_rect = None  # region of the screen under the message
+        self.message_expiry = None  # time in milliseconds the message is hidden at, None to keep it
 
     def open_welcome_page(self):
         welcome_page = Welcome.WelcomePage(self.player_num)
@@ -142,13 +155,43 @@ class GUI:
         """
         return self.card_pressed
 
+    def mark_dirty(self, *rects):
+        """
+        Mark regions of the screen as drawn, they are pushed to the display by the next present
+        :param rects: the regions drawn
+        """
+        self.dirty_rects.extend(rects)
+
+    def present(self):
+        """
+        Push the regions drawn since the last frame to the display, called once per frame by the main loop
+        the message is drawn over the screen for the frame only, so the screen under it is kept
+        """
+        if self.message is not None:
+            # the message is drawn again every frame, over whatever was drawn under it
+            self.mark_dirty(self.message_rect)
+            if self.message_expiry is not None and pygame.time.get_ticks() >= self.message_expiry:
+                self.message = None
+        dirty_rects, self.dirty_rects = self.dirty_rects, []
+        if any(rect.contains(SCREEN_RECT) for rect in dirty_rects):
+            dirty_rects = [SCREEN_RECT]
+        if not dirty_rects:
+            return
+        if self.message is None:
+            pygame.display.update(dirty_rects)
+            return
+        under_message = self.screen.subsurface(self.message_rect).copy()
+        for surface, position in self.message:
+            self.screen.blit(surface, position)
+        pygame.display.update(dirty_rects)
+        self.screen.blit(under_message, self.message_rect.topleft)
+
     def create_screen(self):
         """
         create screen and display the last card pressed (if any)
         """
-        img = pygame.image.load(BACKGROUND)
         # fill screen and show
-        self.screen.blit(img, (0, 0))
+        self.screen.blit(self.assets.background(), (0, 0))
         # draw left card
         pygame.draw.rect(surface=self.screen, color=WHITE,
                          rect=pygame.Rect(250, CARD_PLACE_ROW, CARD_WIDTH, CARD_HEIGHT))
@@ -162,16 +205,13 @@ class GUI:
         pygame.draw.rect(surface=self.screen, color=WHITE,
                          rect=pygame.Rect(30, CARD_PLACE_ROW, CARD_WIDTH, CARD_HEIGHT))
         # draw discard pile
-        pygame.draw.rect(surface=self.screen, color=WHITE, rect=pygame.Rect(DISCARD_PILE_PLACE_ROW,
-                                                                            DISCARD_PILE_PLACE_COLUMN,
-                                                                            CARD_WIDTH, CARD_HEIGHT))
+        pygame.draw.rect(surface=self.screen, color=WHITE, rect=DISCARD_PILE_RECT)
         if self.discard_pile:  # Check if the discard pile is not empty
             # Draw the discard pile only if it's not empty
             card_value = self.discard_pile[-1]
-            card_image = pygame.image.load(f"card_{card_value}.jpg")
-            card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+            card_image = self.assets.card(card_value)
             self.screen.blit(card_image, (DISCARD_PILE_PLACE_ROW, DISCARD_PILE_PLACE_COLUMN))
-        pygame.display.flip()
+        self.mark_dirty(SCREEN_RECT)
         pygame.font.init()
 
     def print_cards(self, game_state):
@@ -181,15 +221,14 @@ class GUI:
         """
         for i, removed in enumerate(self.removed_cards):
             print(f"Cards in hand_{self.player_num}:", removed)
-            card_image = pygame.image.load(f"card_{removed}.jpg")
-            card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+            card_image = self.assets.card(removed)
             if game_state == "TWO":
                 self.screen.blit(card_image, self.two[i].topleft)
             elif game_state == "ONE":
                 self.screen.blit(card_image, self.buttons[1].topleft)
             else:
                 self.screen.blit(card_image, self.buttons[i].topleft)
-        pygame.display.flip()
+        self.mark_dirty(HAND_RECT)
         self.draw_num_of_cards_left()
 
     def draw_player_number(self, player_num):
@@ -199,10 +238,10 @@ class GUI:
         """
         font = pygame.font.Font(None, 30)
         text_surface = font.render(f"Your player num: {player_num}", True, BLACK)
-        pygame.draw.rect(self.screen, WHITE, (10, 10, 200, 50))
+        pygame.draw.rect(self.screen, WHITE, PLAYER_NUMBER_RECT)
         self.screen.blit(text_surface, (20, 20))
         # pygame.display.set_caption("8 1/2 Player:")
-        pygame.display.flip()
+        self.mark_dirty(PLAYER_NUMBER_RECT)
 
     def draw_num_of_cards_left(self):
         """
@@ -210,12 +249,11 @@ class GUI:
         """
         font = pygame.font.Font(None, 40)
         text_surface = font.render(str(len(self.decks)), True, BLACK)
-        chabila_rect = pygame.Rect(30, CARD_PLACE_ROW, CARD_WIDTH, CARD_HEIGHT)
-        text_rect = text_surface.get_rect(center=chabila_rect.center)
-        self.screen.fill(WHITE, chabila_rect)
+        text_rect = text_surface.get_rect(center=DECK_COUNTER_RECT.center)
+        self.screen.fill(WHITE, DECK_COUNTER_RECT)
         # Draw the text
         self.screen.blit(text_surface, text_rect)
-        pygame.display.flip()
+        self.mark_dirty(DECK_COUNTER_RECT)
 
     def draw_current_player(self, current_player):
         """
@@ -224,9 +262,9 @@ class GUI:
         """
         font = pygame.font.Font(None, 30)
         text_surface = font.render(f"Current player: {current_player}", True, BLACK)
-        pygame.draw.rect(self.screen, WHITE, (10, 70, 200, 50))
+        pygame.draw.rect(self.screen, WHITE, CURRENT_PLAYER_RECT)
         self.screen.blit(text_surface, (20, 80))
-        pygame.display.flip()
+        self.mark_dirty(CURRENT_PLAYER_RECT)
 
     def print_card(self):
         """
@@ -234,10 +272,9 @@ class GUI:
         """
         for i, removed in enumerate(self.removed_cards):
             print(f"Cards in hand_{self.player_num}:", removed)
-            card_image = pygame.image.load(f"card_{removed}.jpg")
-            card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+            card_image = self.assets.card(removed)
             self.screen.blit(card_image, self.buttons[i].topleft)
-        pygame.display.flip()
+        self.mark_dirty(HAND_RECT)
 
     def choose_card(self):
         """
@@ -259,7 +296,7 @@ class GUI:
                             self.card_value = self.removed_cards[self.card_pressed - 1]
 
                             return self.card_pressed
-            pygame.display.flip()
+            self.present()
             CLOCK.tick(REFRESH_RATE)
 
     def move_to_middle(self, removed_cards, card_pressed):
@@ -272,10 +309,9 @@ class GUI:
         self.card_value = removed_cards[card_pressed - 1]
 
         self.discard_pile.append(self.card_value)
-        card_image = pygame.image.load(f"card_{self.card_value}.jpg")
-        card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+        card_image = self.assets.card(self.card_value)
         self.screen.blit(card_image, (DISCARD_PILE_PLACE_ROW, DISCARD_PILE_PLACE_COLUMN))
-        pygame.display.flip()
+        self.mark_dirty(DISCARD_PILE_RECT)
 
     def draw_new_card(self, card_pressed):
         """
@@ -286,10 +322,9 @@ class GUI:
         # card_value = self.removed_cards[self.player_num - 1][-1] %
         card_value = self.removed_cards[-1]
 
-        card_image = pygame.image.load(f"card_{card_value}.jpg")
-        card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+        card_image = self.assets.card(card_value)
         self.screen.blit(card_image, button_rect)
-        pygame.display.flip()
+        self.mark_dirty(button_rect)
 
         # Update the order of cards in removed_cards for the current player
         beg = self.removed_cards[:card_pressed - 1]
@@ -303,15 +338,13 @@ class GUI:
         :param card_value: Value of card to be drawn
         """
         # Load the card image based on the card_value parameter
-        card_image = pygame.image.load(f"card_{card_value}.jpg")
-        card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+        card_image = self.assets.card(card_value)
 
         # Draw the card image in the middle square
-        middle_rect = pygame.Rect(DISCARD_PILE_PLACE_ROW, DISCARD_PILE_PLACE_COLUMN, CARD_WIDTH, CARD_HEIGHT)
-        self.screen.blit(card_image, middle_rect.topleft)
+        self.screen.blit(card_image, DISCARD_PILE_RECT.topleft)
 
         # Update the display
-        pygame.display.flip()
+        self.mark_dirty(DISCARD_PILE_RECT)
         self.draw_num_of_cards_left()
 
     def replace_chosen_card(self, card_pressed, removed_cards):
@@ -333,10 +366,11 @@ class GUI:
         else:
             return False
 
-    def display_message(self, text):
+    def display_message(self, text, duration=MESSAGE_TIME):
         """
-        Display message on screen
+        Display message on screen, over everything drawn until it expires, without waiting for it
         :param text: text to be displayed
+        :param duration: milliseconds to show the message, None to keep it until the next message
         :return:
         """
         # Render the message with a white highlight
@@ -349,11 +383,12 @@ class GUI:
         text_surface = text_font.render(text, True, BLACK)
         text_rect = text_surface.get_rect(center=(450, 300))
 
-        # Display the message with the white highlight and black text
-        self.screen.blit(text_surface_highlight, text_rect_highlight)
-        self.screen.blit(text_surface, text_rect)
-        pygame.display.flip()
-        pygame.time.wait(1000)  # Wait for 1000 milliseconds (1 second)
+        # Display the message with the white highlight and black text, present draws it every frame
+        if self.message is not None:
+            self.mark_dirty(self.message_rect)  # the old message is hidden
+        self.message = ((text_surface_highlight, text_rect_highlight), (text_surface, text_rect))
+        self.message_rect = text_rect_highlight.union(text_rect).clip(SCREEN_RECT)
+        self.message_expiry = None if duration is None else pygame.time.get_ticks() + duration
 
     def restart(self):
         """
@@ -361,24 +396,21 @@ class GUI:
         :return:
         """
         # draw discard pile
-        pygame.draw.rect(surface=self.screen, color=WHITE,
-                         rect=pygame.Rect(DISCARD_PILE_PLACE_ROW, DISCARD_PILE_PLACE_COLUMN, CARD_WIDTH, CARD_HEIGHT))
-        pygame.display.flip()
+        pygame.draw.rect(surface=self.screen, color=WHITE, rect=DISCARD_PILE_RECT)
+        self.mark_dirty(DISCARD_PILE_RECT)
         pygame.font.init()
         self.bank[self.player_num - 1] = self.discard_pile
         self.discard_pile.clear()
         self.create_screen()  # Re-create the screen to update the display
         self.print_cards("")  # Print the cards for the current player
-        pygame.display.flip()
 
     def redo(self):
         """
         draw an empty discard pile
         """
         # draw discard pile
-        pygame.draw.rect(surface=self.screen, color=WHITE,
-                         rect=pygame.Rect(DISCARD_PILE_PLACE_ROW, DISCARD_PILE_PLACE_COLUMN, CARD_WIDTH, CARD_HEIGHT))
-        pygame.display.flip()
+        pygame.draw.rect(surface=self.screen, color=WHITE, rect=DISCARD_PILE_RECT)
+        self.mark_dirty(DISCARD_PILE_RECT)
 
     def draw_last_cards(self):
         """
@@ -390,14 +422,12 @@ class GUI:
         end = self.removed_cards[self.card_pressed:]
         self.removed_cards = beg + end
         self.card_value = self.removed_cards[0]
-        card_image = pygame.image.load(f"card_{self.card_value}.jpg")
-        card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+        card_image = self.assets.card(self.card_value)
         self.screen.blit(card_image, (DISCARD_PILE_PLACE_ROW, DISCARD_PILE_PLACE_COLUMN))
 
-        card_image = pygame.image.load(f"card_{self.card_value}.jpg")
-        card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+        card_image = self.assets.card(self.card_value)
         self.screen.blit(card_image, self.buttons[1].topleft)
-        pygame.display.flip()
+        self.mark_dirty(DISCARD_PILE_RECT, HAND_RECT)
         print(self.removed_cards)
 
     def draw_two_cards(self):
@@ -407,18 +437,16 @@ class GUI:
         # clear screen
         self.create_screen()
         self.card_value = self.removed_cards[self.card_pressed - 1]
-        card_image = pygame.image.load(f"card_{self.card_value}.jpg")
-        card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+        card_image = self.assets.card(self.card_value)
         self.screen.blit(card_image, (DISCARD_PILE_PLACE_ROW, DISCARD_PILE_PLACE_COLUMN))
         beg = self.removed_cards[:self.card_pressed-1]
         end = self.removed_cards[self.card_pressed:]
         self.removed_cards = beg + end
         for i, removed in enumerate(self.removed_cards):
             print(f"Cards in hand_{self.player_num}:", removed)
-            card_image = pygame.image.load(f"card_{removed}.jpg")
-            card_image = pygame.transform.scale(card_image, (CARD_WIDTH, CARD_HEIGHT))
+            card_image = self.assets.card(removed)
             self.screen.blit(card_image, self.two[i].topleft)
-        pygame.display.flip()
+        self.mark_dirty(DISCARD_PILE_RECT, HAND_RECT)
         print(self.removed_cards)
 
 
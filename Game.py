@@ -3,10 +3,22 @@ author: Ofri Guz
 Date: 01/06/24
 description: game class that handles the game rules
 """
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 #  constants
 GHOST = 10
 HALF = 11
 ZERO = 0
+NUM_OF_CARDS = 12  # card values are 0 to 11 (GHOST and HALF included)
+EMPTY_PILE = 0  # pile state id of an empty discard pile
+MAX_DOUBLED_VALUE = 20  # pile values above 10 follow the same rules as 9.5 or 10
+NUM_OF_PILE_STATES = MAX_DOUBLED_VALUE + 2  # rows of VALID_MOVES and PLAYABLE_CARDS, the empty pile and 0 to 10
+NO_CARD = -1  # padding of the pile and hand arrays of the batch functions
+NO_YELLOW_CARD = 15  # lowest card sent by a player with no yellow cards, like Client.lowest_card
+HAND_SIZE = 3  # Cards in a player's hand, the first cards of the personal deck
 
 
 class GAME:
@@ -142,6 +154,234 @@ class GAME:
         return False
 
 
+def card_rule(last_card_played, card_played):
+    """
+    the rules of GAME.is_card_valid once the value of the discard pile is known
+    :param last_card_played: value of the discard pile (may be x.5), None if the pile is empty
+    :param card_played: card wanting to be played
+    :return: True if card played is valid, False otherwise
+    :rtype: bool
+    """
+    if last_card_played is None:
+        return card_played != GHOST and card_played != HALF and card_played != ZERO
+    if last_card_played == 5:
+        return card_played <= 5 or card_played >= 10
+    if card_played == ZERO:
+        return float(last_card_played).is_integer()
+    if last_card_played == 8.5:
+        return card_played == 9 or card_played == GHOST
+    if card_played == GHOST or card_played == HALF:
+        return True
+    return 0 <= last_card_played <= 9 and card_played >= last_card_played
+
+
+def pile_state_id(last_card_played):
+    """
+    get the id of a pile value, piles with the same id accept the same cards
+    :param last_card_played: value of the discard pile (may be x.5), None if the pile is empty
+    :return: index in VALID_MOVES and PLAYABLE_CARDS
+    :rtype: int
+    """
+    if last_card_played is None:
+        return EMPTY_PILE
+    doubled_value = int(last_card_played * 2)
+    if doubled_value > MAX_DOUBLED_VALUE:
+        doubled_value = MAX_DOUBLED_VALUE - doubled_value % 2
+    return doubled_value + 1
+
+
+def hand_mask(removed_cards):
+    """
+    get the bitmask of the cards in a hand, bit n is set if the hand has a card n
+    :param removed_cards: List of cards in players hand
+    :return: bitmask of the hand
+    :rtype: int
+    """
+    mask = 0
+    for card in removed_cards:
+        mask |= 1 << card
+    return mask
+
+
+def pick_starting_player(lowest_cards):
+    """
+    Pick the starting player
+    Choose the player with the lowest card
+    :param lowest_cards: array of the lowest card of each player
+    :return: Starting player
+    """
+    if not lowest_cards:
+        raise ValueError("The list of cards is empty")
+    lowest_card = min(lowest_cards)
+    if lowest_card == NO_YELLOW_CARD:
+        return 1
+    return lowest_cards.index(lowest_card) + 1
+
+
+def compile_rules():
+    """
+    evaluate the rules once for every pile state and card
+    :return: VALID_MOVES (validity of each card in each pile state) and PLAYABLE_CARDS (bitmask of the
+    valid cards in each pile state)
+    :rtype: tuple
+    """
+    # the value of each pile state id, the inverse of pile_state_id
+    values = [None if state_id == EMPTY_PILE else (state_id - 1) / 2 for state_id in range(NUM_OF_PILE_STATES)]
+    valid_moves = tuple(tuple(card_rule(value, card) for card in range(NUM_OF_CARDS)) for value in values)
+    playable_cards = tuple(hand_mask(card for card in range(NUM_OF_CARDS) if valid[card]) for valid in valid_moves)
+    return valid_moves, playable_cards
+
+
+VALID_MOVES, PLAYABLE_CARDS = compile_rules()
+
+
+class PileState:
+    """
+    Effective top of the discard pile, updated in O(1) for every card pushed
+    gives the same answers as GAME without walking back over GHOST and HALF cards
+    """
+    def __init__(self, discard_pile=()):
+        """
+        Initialize the pile state
+        :param discard_pile: cards already in the discard pile
+        :type discard_pile: list
+        """
+        self.base = None  # last card played that is not GHOST or HALF
+        self.halves = 0  # HALF cards played on top of base
+        self.ghost_over_half = False  # True if the top card is a GHOST and the card below the ghosts is a HALF
+        self.top = None  # last card played
+        self.size = 0  # number of cards in the pile
+        self.state = EMPTY_PILE  # pile state id of the value of the pile
+        for card in discard_pile:
+            self.push(card)
+
+    def reset(self):
+        """
+        empty the pile (after a player passed)
+        """
+        self.base = None
+        self.halves = 0
+        self.ghost_over_half = False
+        self.top = None
+        self.size = 0
+        self.state = EMPTY_PILE
+
+    def push(self, card):
+        """
+        put a card on top of the pile
+        :param card: card played
+        :type card: int
+        """
+        if card == HALF:
+            self.halves += 1
+            self.ghost_over_half = False
+        elif card == GHOST:
+            # a ghost keeps the value below it, GAME counts the HALF below the ghosts one extra time
+            if self.top == HALF:
+                self.ghost_over_half = True
+        else:
+            self.base = card
+            self.halves = 0
+            self.ghost_over_half = False
+        self.top = card
+        self.size += 1
+        self.state = pile_state_id(self.value())
+
+    def value(self):
+        """
+        get the value the next card is compared to
+        :return: value of the pile (may be x.5), None if the pile is empty
+        """
+        if self.base is None:
+            return None
+        if self.top == HALF:
+            return self.base + self.halves / 2
+        if self.ghost_over_half:
+            return self.base + (self.halves + 1) / 2
+        return self.base
+
+    def is_card_valid(self, card_played):
+        """
+        Check if a card can be played on the pile according to the game rules
+        :param card_played: card wanting to be played
+        :return: True if card played is valid, False otherwise
+        :rtype: bool
+        """
+        return VALID_MOVES[self.state][card_played]
+
+    def have_valid_card(self, removed_cards):
+        """
+        Checks if player has a valid card that can be played
+        :param removed_cards: List of cards in players hand
+        :return: True if player has a valid card, otherwise False
+        :rtype: bool
+        """
+        return hand_mask(removed_cards) & PLAYABLE_CARDS[self.state] != 0
+
+
+def require_numpy():
+    """
+    make sure NumPy is installed before using the batch functions
+    :raises ImportError: If NumPy is not installed
+    """
+    if np is None:
+        raise ImportError("the batch functions of Game need NumPy, install it with 'pip install numpy'")
+
+
+def batch_pile_states(piles):
+    """
+    get the pile state id of many discard piles at once, with the same ghost and half rules as PileState
+    the piles are pushed one column at a time, so the cost grows with the longest pile and not with their number
+    :param piles: 2D array of cards, one pile per row, padded with NO_CARD
+    :return: array of pile state ids, one per pile
+    :rtype: numpy.ndarray
+    """
+    require_numpy()
+    piles = np.asarray(piles, dtype=np.int64).reshape(len(piles), -1)
+    base = np.full(len(piles), NO_CARD, dtype=np.int64)
+    halves = np.zeros(len(piles), dtype=np.int64)
+    ghost_over_half = np.zeros(len(piles), dtype=bool)
+    top = np.full(len(piles), NO_CARD, dtype=np.int64)
+    for cards in piles.T:
+        is_half = cards == HALF
+        is_ghost = cards == GHOST
+        is_base = (cards != NO_CARD) & ~is_half & ~is_ghost
+        halves = np.where(is_half, halves + 1, np.where(is_base, 0, halves))
+        ghost_over_half = (ghost_over_half | (is_ghost & (top == HALF))) & ~is_half & ~is_base
+        base = np.where(is_base, cards, base)
+        top = np.where(cards != NO_CARD, cards, top)
+    doubled_value = 2 * base + np.where(top == HALF, halves, np.where(ghost_over_half, halves + 1, 0))
+    doubled_value = np.where(doubled_value > MAX_DOUBLED_VALUE, MAX_DOUBLED_VALUE - doubled_value % 2,
+                             doubled_value)
+    return np.where(base == NO_CARD, EMPTY_PILE, doubled_value + 1)
+
+
+def batch_is_card_valid(states, cards):
+    """
+    Check many cards against many pile states at once
+    :param states: array of pile state ids (from PileState.state or batch_pile_states)
+    :param cards: array of cards wanting to be played, the same shape as states
+    :return: array of True for each valid card, False otherwise
+    :rtype: numpy.ndarray
+    """
+    require_numpy()
+    return np.asarray(VALID_MOVES, dtype=bool)[np.asarray(states), np.asarray(cards)]
+
+
+def batch_have_valid_card(states, hands):
+    """
+    Checks for many hands at once if they have a valid card that can be played
+    :param states: array of pile state ids (from PileState.state or batch_pile_states)
+    :param hands: 2D array of cards, one hand per row, padded with NO_CARD
+    :return: array of True for each hand that has a valid card, False otherwise
+    :rtype: numpy.ndarray
+    """
+    require_numpy()
+    hands = np.asarray(hands, dtype=np.int64).reshape(len(hands), -1)
+    masks = np.bitwise_or.reduce(np.where(hands == NO_CARD, 0, np.left_shift(1, hands.clip(0))), axis=1)
+    return masks & np.asarray(PLAYABLE_CARDS, dtype=np.int64)[np.asarray(states)] != 0
+
+
 def test_game_class():
     try:
         # Test scenario 1: Empty discard pile and a non-special card
@@ -215,6 +455,43 @@ def test_game_class():
         game18 = GAME([5, HALF, HALF], 6, [1, 2, 4])
         assert game18.is_card_valid() is True, "Test scenario 18 failed"
 
+        # Test scenario 19: PileState gives the same answers as GAME
+        piles = [[], [1, 3, GHOST, 5, 3, GHOST, GHOST], [2, 3, GHOST, HALF], [1, 2, 5], [2, 5, 5],
+                 [1, 2, 3, 6, GHOST], [2, 7, GHOST], [3, HALF, 8, HALF], [8, HALF], [7], [7, HALF],
+                 [5, HALF, HALF, GHOST, HALF, HALF, GHOST, GHOST], [5, HALF, HALF], [4, HALF, HALF],
+                 [9, HALF], [9, HALF, HALF], [7, HALF, GHOST], [8, HALF, GHOST, GHOST], [6, ZERO]]
+        for pile in piles:
+            pile_state = PileState(pile)
+            for card in range(12):
+                assert bool(GAME(pile, card, []).is_card_valid()) == pile_state.is_card_valid(card), \
+                    "Test scenario 19 failed"
+
+        # Test scenario 20: the hand bitmask finds a valid card like GAME does
+        for pile in piles:
+            pile_state = PileState(pile)
+            for hand in ([1, 2, 4], [GHOST, HALF], [ZERO, 9], [6, 7, 8], []):
+                assert bool(GAME(pile, None, hand).have_valid_card()) == pile_state.have_valid_card(hand), \
+                    "Test scenario 20 failed"
+
+        # Test scenario 21: the batch functions give the same answers as PileState
+        if np is not None:
+            longest = max(len(pile) for pile in piles)
+            states = batch_pile_states([pile + [NO_CARD] * (longest - len(pile)) for pile in piles])
+            assert list(states) == [PileState(pile).state for pile in piles], "Test scenario 21 failed"
+            for card in range(NUM_OF_CARDS):
+                valid = batch_is_card_valid(states, [card] * len(piles))
+                assert list(valid) == [PileState(pile).is_card_valid(card) for pile in piles], \
+                    "Test scenario 21 failed"
+            hands = [[1, 2, 4], [GHOST, HALF, NO_CARD], [ZERO, 9, NO_CARD], [6, 7, 8]]
+            for hand in hands:
+                valid = batch_have_valid_card(states, [hand] * len(piles))
+                assert list(valid) == [PileState(pile).have_valid_card([card for card in hand if card != NO_CARD])
+                                       for pile in piles], "Test scenario 21 failed"
+
+        # Test scenario 22: the player with the lowest yellow card starts, the first player if no one has one
+        assert pick_starting_player([3, 6, 2, 9]) == 3, "Test scenario 22 failed"
+        assert pick_starting_player([NO_YELLOW_CARD, NO_YELLOW_CARD]) == 1, "Test scenario 22 failed"
+
         print("All tests passed!")
     except AssertionError as e:
         print(e)
@@ -0,0 +1,225 @@
+"""
+author: Ofri Guz
+Date: 01/06/24
+description: matchmaking queue that groups waiting clients into tables of 2 to 4 players
+"""
+import time
+from collections import deque
+import Protocol
+
+#  constants
+MIN_PLAYERS = 2
+MAX_PLAYERS = 4
+TABLE_SIZES = range(MIN_PLAYERS, MAX_PLAYERS + 1)
+ANY = Protocol.ANY_TABLE_SIZE  # preference of a client that plays in a table of any size
+FALLBACK_WAIT = 30  # Seconds a client waits before its table may start with fewer players
+
+
+class Ticket:
+    """
+    A client waiting in the matchmaking queue
+    """
+    __slots__ = ('client', 'preference', 'enqueue_time', 'cancelled')
+
+    def __init__(self, client, preference, enqueue_time):
+        """
+        Initialize the ticket
+        :param client: the waiting client (the server uses its socket)
+        :param preference: preferred table size, or ANY
+        :type preference: int
+        :param enqueue_time: time the client joined the queue
+        :type enqueue_time: float
+        """
+        self.client = client
+        self.preference = preference
+        self.enqueue_time = enqueue_time
+        self.cancelled = False
+
+
+class MatchmakingQueue:
+    """
+    Queue of clients waiting for a table
+    clients wait in one FIFO per preference, so adding a client, cancelling it and forming a table
+    take constant time no matter how many clients are waiting
+    """
+    def __init__(self, fallback_wait=FALLBACK_WAIT, clock=time.monotonic):
+        """
+        Initialize the queue
+        :param fallback_wait: seconds before a table may start with fewer players than preferred
+        :type fallback_wait: float
+        :param clock: function that returns the current time in seconds
+        """
+        self.fallback_wait = fallback_wait
+        self.clock = clock
+        self.waiting = {preference: deque() for preference in (ANY, *TABLE_SIZES)}
+        self.counts = {preference: 0 for preference in self.waiting}  # tickets that were not cancelled
+        self.matched = 0  # clients seated since the queue was created
+        self.total_wait = 0.0  # seconds the seated clients waited, together
+        self.longest_wait = 0.0
+
+    def add(self, client, preference=ANY):
+        """
+        add a client to the queue
+        :param client: the waiting client
+        :param preference: preferred table size, or ANY
+        :return: the client's ticket, used to cancel it
+        :rtype: Ticket
+        """
+        if preference not in self.waiting:
+            raise ValueError(f"Invalid table size: {preference}")
+        ticket = Ticket(client, preference, self.clock())
+        self.waiting[preference].append(ticket)
+        self.counts[preference] += 1
+        return ticket
+
+    def cancel(self, ticket):
+        """
+        remove a client from the queue, the ticket is skipped when it reaches the front of its FIFO
+        :param ticket: the client's ticket
+        """
+        if not ticket.cancelled:
+            ticket.cancelled = True
+            self.counts[ticket.preference] -= 1
+
+    def depth(self):
+        """
+        :return: number of clients waiting
+        :rtype: int
+        """
+        return sum(self.counts.values())
+
+    def oldest(self, preference):
+        """
+        get the client that waited the longest with a preference, dropping cancelled tickets
+        :param preference: table size, or ANY
+        :return: the oldest ticket, None if no client with this preference is waiting
+        :rtype: Ticket
+        """
+        tickets = self.waiting[preference]
+        while tickets and tickets[0].cancelled:
+            tickets.popleft()
+        return tickets[0] if tickets else None
+
+    def take(self, preference, count, now, table):
+        """
+        move the oldest clients with a preference into a table
+        :param preference: table size, or ANY
+        :param count: number of clients to move
+        :param now: current time
+        :param table: list of the clients in the table
+        """
+        for i in range(count):
+            ticket = self.oldest(preference)
+            self.waiting[preference].popleft()
+            self.counts[preference] -= 1
+            ticket.cancelled = True
+            wait = now - ticket.enqueue_time
+            self.matched += 1
+            self.total_wait += wait
+            self.longest_wait = max(self.longest_wait, wait)
+            table.append(ticket.client)
+
+    def form_table(self, size, now, fallback):
+        """
+        form a single table of clients that prefer its size, filled with clients that play any size
+        :param size: table size
+        :param now: current time
+        :param fallback: True to start the table with fewer players when not enough are waiting
+        :return: clients of the table, None if the table can not be formed
+        :rtype: list
+        """
+        preferred = self.counts[size]
+        available = preferred + self.counts[ANY]
+        table_size = size
+        if available < size:
+            if not fallback or available < MIN_PLAYERS:
+                return None
+            table_size = available
+        table = []
+        self.take(size, min(preferred, table_size), now, table)
+        self.take(ANY, table_size - len(table), now, table)
+        return table
+
+    def match(self, now=None):
+        """
+        form every table that can start
+        a table of a size starts as soon as enough compatible clients wait, or with fewer players once
+        the oldest client that prefers its size waited longer than the fallback wait
+        :param now: current time, the queue's clock by default
+        :return: list of tables, each a list of clients in the order they will play
+        :rtype: list
+        """
+        if now is None:
+            now = self.clock()
+        tables = []
+        formed = True
+        while formed:
+            formed = False
+            for size in TABLE_SIZES:
+                oldest = self.oldest(size)
+                fallback = oldest is not None and now - oldest.enqueue_time >= self.fallback_wait
+                table = self.form_table(size, now, fallback)
+                if table is not None:
+                    tables.append(table)
+                    formed = True
+            if self.counts[ANY] >= MIN_PLAYERS:
+                tables.append(self.form_table(MIN_PLAYERS, now, False))
+                formed = True
+        return tables
+
+    def next_deadline(self):
+        """
+        get the time when a waiting client reaches the fallback wait
+        :return: the time, None if no client that prefers a size is waiting
+        :rtype: float
+        """
+        deadlines = [ticket.enqueue_time + self.fallback_wait
+                     for ticket in (self.oldest(size) for size in TABLE_SIZES) if ticket is not None]
+        return min(deadlines) if deadlines else None
+
+    def stats(self):
+        """
+        get the queue metrics
+        :return: queue depth (total and for each preference) and time to match of the seated clients
+        :rtype: dict
+        """
+        return {
+            'depth': self.depth(),
+            'depth_by_preference': dict(self.counts),
+            'matched': self.matched,
+            'average_wait': self.total_wait / self.matched if self.matched else 0.0,
+            'longest_wait': self.longest_wait,
+        }
+
+
+if __name__ == '__main__':
+    # Assertions
+    clock_time = [0.0]
+    queue = MatchmakingQueue(fallback_wait=10, clock=lambda: clock_time[0])
+
+    # Check that clients of any size are seated in pairs as soon as they wait
+    queue.add('a')
+    assert queue.match() == []
+    queue.add('b')
+    assert queue.match() == [['a', 'b']]
+
+    # Check that a preferred size waits for enough players and is filled with clients of any size
+    queue.add('c', 3)
+    queue.add('d', 3)
+    assert queue.match() == []
+    queue.add('e')
+    assert queue.match() == [['c', 'd', 'e']]
+
+    # Check that cancelled clients are skipped
+    f = queue.add('f', 4)
+    queue.cancel(f)
+    assert queue.depth() == 0
+
+    # Check that a table starts with fewer players after the fallback wait
+    queue.add('g', 4)
+    queue.add('h', 4)
+    assert queue.match() == []
+    assert queue.next_deadline() == 10
+    clock_time[0] = 10
+    assert queue.match() == [['g', 'h']]
+    assert queue.stats()['matched'] == 7
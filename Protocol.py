@@ -1,7 +1,287 @@
-import logging
+import struct
 import traceback
+import weakref
+from collections import deque
 
 SEPERATOR = '|'
+SEPERATOR_BYTE = SEPERATOR.encode()
+MESSAGE_SEPERATOR = '$'  # Separator between the fields of a text message
+READ_SIZE = 4096  # Number of bytes read from the socket at a time
+MAX_LENGTH_DIGITS = 9  # Maximum number of digits in the length prefix of a frame
+
+# protocol versions, agreed on with a HEL message right after connecting
+TEXT_VERSION = 1  # len|TYPE$a$b$c frames, spoken by every client
+BINARY_VERSION = 2  # struct packed frames
+DRAW_VERSION = 3  # struct packed frames, DEK deals only the hand and every card drawn is sent in a DRW message
+PROTOCOL_VERSION = DRAW_VERSION  # Highest version this side speaks
+
+# binary format: header of magic byte, body length and message type, followed by the body
+BINARY_MAGIC = 0xB8  # First byte of a binary frame, never a digit of a text length prefix
+BINARY_HEADER = struct.Struct('!BHB')
+MESSAGE_CODES = {'HEL': 1, 'NUM': 2, 'DEK': 3, 'LOW': 4, 'DON': 5, 'UPD': 6, 'SIZ': 7, 'DRW': 8}
+MESSAGE_TYPES = {code: msg_type for msg_type, code in MESSAGE_CODES.items()}
+BINARY_BODIES = {
+    'HEL': struct.Struct('!B'),  # version
+    'NUM': struct.Struct('!B'),  # player
+    'SIZ': struct.Struct('!B'),  # preferred table size
+    'LOW': struct.Struct('!B?B?'),  # card, did_win, player, did_turn
+    'DON': struct.Struct('!B?B?'),  # card, did_win, player, did_turn
+    'UPD': struct.Struct('!?BB'),  # did_win, player, card
+    'DRW': struct.Struct('!BB'),  # card drawn, cards left in the personal deck
+}  # DEK body is one byte per card
+CARD_FIELDS = {'LOW': 0, 'DON': 0, 'UPD': 2, 'DRW': 0}  # index of the card field in each message
+EMPTY = "EMPTY"  # Card field of a turn with no card played
+EMPTY_CARD = 0xFF  # EMPTY in the binary format
+ANY_TABLE_SIZE = 0  # SIZ value of a client that plays in a table of any size
+
+
+class FrameParser:
+    """
+    Incremental parser of protocol frames that never touches a socket
+    bytes are fed in as they arrive and every complete frame is returned, partial frames
+    are kept until the rest of them is fed
+    """
+    def __init__(self):
+        """
+        Initialize the frame parser
+        """
+        self.buffer = bytearray()  # bytes fed that are not yet part of a complete frame
+
+    def feed(self, data):
+        """
+        add received bytes to the parser and extract every complete frame
+        :param data: bytes received
+        :type data: bytes or bytearray or memoryview
+        :return: payloads of all the complete frames, in order. binary payloads start with their type code
+        :rtype: list of bytes
+
+        :raises ValueError: If the length prefix of a frame is not a number
+        """
+        self.buffer += data
+        messages = []
+        start = 0
+        while start < len(self.buffer):
+            if self.buffer[start] == BINARY_MAGIC:
+                if len(self.buffer) - start < BINARY_HEADER.size:
+                    break
+                body_len = BINARY_HEADER.unpack_from(self.buffer, start)[1]
+                end = start + BINARY_HEADER.size + body_len
+                if end > len(self.buffer):
+                    break
+                messages.append(bytes(self.buffer[start + BINARY_HEADER.size - 1:end]))
+                start = end
+                continue
+            separator_index = self.buffer.find(SEPERATOR_BYTE, start, start + MAX_LENGTH_DIGITS + 1)
+            if separator_index == -1:
+                if len(self.buffer) - start > MAX_LENGTH_DIGITS:
+                    raise ValueError("Invalid frame: length prefix is too long")
+                break
+            length_prefix = self.buffer[start:separator_index]
+            if not length_prefix.isdigit():
+                raise ValueError(f"Invalid frame length: {bytes(length_prefix)!r}")
+            end = separator_index + 1 + int(length_prefix)
+            if end > len(self.buffer):
+                break
+            messages.append(bytes(self.buffer[separator_index + 1:end]))
+            start = end
+        del self.buffer[:start]
+        return messages
+
+
+def encode_frame(message):
+    """
+    prepare a message to be sent, following the protocol
+    the length of the payload in bytes is prepended to it, separated by a separator character
+    :param message: message to be sent
+    :type message: str or bytes
+    :return: frame ready to be sent on a socket
+    :rtype: bytes
+    """
+    if isinstance(message, str):
+        message = message.encode()
+    return str(len(message)).encode() + SEPERATOR_BYTE + message
+
+
+def encode_message(version, msg_type, *fields):
+    """
+    encode a message in the format of the protocol version agreed with the other side
+    :param version: protocol version (TEXT_VERSION, BINARY_VERSION or DRAW_VERSION)
+    :type version: int
+    :param msg_type: message type (HEL, SIZ, NUM, DEK, LOW, DON, UPD, DRW)
+    :type msg_type: str
+    :param fields: fields of the message in the order of the text format, DEK takes a single list of cards
+    :return: frame ready to be sent on a socket
+    :rtype: bytes
+    """
+    if msg_type == 'DEK':
+        fields = fields[0]
+    if version < BINARY_VERSION:
+        return encode_frame(msg_type + MESSAGE_SEPERATOR + MESSAGE_SEPERATOR.join(map(str, fields)))
+    if msg_type == 'DEK':
+        body = bytes(fields)
+    else:
+        if msg_type in CARD_FIELDS:
+            card_index = CARD_FIELDS[msg_type]
+            fields = list(fields)
+            fields[card_index] = EMPTY_CARD if fields[card_index] == EMPTY else int(fields[card_index])
+        body = BINARY_BODIES[msg_type].pack(*fields)
+    return BINARY_HEADER.pack(BINARY_MAGIC, len(body), MESSAGE_CODES[msg_type]) + body
+
+
+def decode_text_message(message):
+    """
+    decode a message in the text format
+    :param message: payload of a text frame
+    :type message: str
+    :return: message type followed by its fields
+    :rtype: tuple
+    """
+    msg_type, ignore, rest = message.partition(MESSAGE_SEPERATOR)
+    fields = rest.split(MESSAGE_SEPERATOR) if rest else []
+    if msg_type == 'DEK':
+        return msg_type, list(map(int, fields))
+    if msg_type == 'HEL' or msg_type == 'NUM' or msg_type == 'SIZ':
+        return msg_type, int(''.join(fields))
+    if msg_type == 'LOW' or msg_type == 'DON':
+        card, did_win, player, did_turn = fields
+        return msg_type, card if card == EMPTY else int(card), did_win != "False", int(player), did_turn != "False"
+    if msg_type == 'UPD':
+        did_win, player, card = fields
+        return msg_type, did_win != "False", int(player), card if card == EMPTY else int(card)
+    if msg_type == 'DRW':
+        card, cards_left = fields
+        return msg_type, card if card == EMPTY else int(card), int(cards_left)
+    return (msg_type, *fields)
+
+
+def decode_binary_message(message):
+    """
+    decode a message in the binary format
+    :param message: payload of a binary frame (type code followed by the body)
+    :type message: bytes
+    :return: message type followed by its fields
+    :rtype: tuple
+
+    :raises ValueError: If the body is not the size of the message type's body
+    """
+    msg_type = MESSAGE_TYPES[message[0]]
+    if msg_type == 'DEK':
+        return msg_type, list(message[1:])
+    if len(message) - 1 != BINARY_BODIES[msg_type].size:
+        raise ValueError(f"Invalid {msg_type} body length: {len(message) - 1}")
+    fields = BINARY_BODIES[msg_type].unpack_from(message, 1)
+    if msg_type in CARD_FIELDS:
+        card_index = CARD_FIELDS[msg_type]
+        if fields[card_index] == EMPTY_CARD:
+            fields = fields[:card_index] + (EMPTY,) + fields[card_index + 1:]
+    return (msg_type, *fields)
+
+
+def decode_message(message):
+    """
+    decode a message received in either format
+    :param message: message returned by protocol_receive
+    :type message: str or bytes
+    :return: message type followed by its fields, cards are int or EMPTY and flags are bool
+    :rtype: tuple
+    """
+    if isinstance(message, str):
+        return decode_text_message(message)
+    if message and message[0] in MESSAGE_TYPES:
+        return decode_binary_message(message)
+    return decode_text_message(message.decode())
+
+
+class FrameReader:
+    """
+    Buffered reader of protocol frames for a single socket
+    reads large chunks from the socket into a reusable buffer and feeds them to a FrameParser
+    """
+    def __init__(self, my_socket, read_size=READ_SIZE):
+        """
+        Initialize the frame reader
+        :param my_socket: The socket object used to receive messages
+        :type my_socket: socket.socket
+        :param read_size: number of bytes to read from the socket at a time
+        :type read_size: int
+        """
+        self.my_socket = my_socket
+        self.chunk = bytearray(read_size)  # reusable buffer for recv_into
+        self.parser = FrameParser()
+        self.messages = deque()  # complete messages waiting to be returned
+
+    def has_pending(self):
+        """
+        check if there are complete messages waiting in the buffer
+        :return: True if a message can be returned without reading from the socket
+        :rtype: bool
+        """
+        return len(self.messages) > 0
+
+    def read_frames(self):
+        """
+        read one chunk from the socket and keep every complete frame in it
+        :raises ConnectionResetError: If the socket was closed by the other side
+        """
+        received = self.my_socket.recv_into(self.chunk)
+        if received == 0:
+            raise ConnectionResetError("Connection closed by peer")
+        with memoryview(self.chunk) as view:
+            self.messages.extend(self.parser.feed(view[:received]))
+
+    def receive(self):
+        """
+        return the next message, reading from the socket only when no complete message is buffered
+        :return: the next message
+        :rtype: bytes
+        """
+        while not self.has_pending():
+            self.read_frames()
+        return self.messages.popleft()
+
+
+readers = weakref.WeakKeyDictionary()  # FrameReader of each socket
+
+
+def get_reader(my_socket):
+    """
+    get the frame reader of a socket, creating it on first use
+    :param my_socket: The socket object used to receive messages
+    :return: the socket's frame reader
+    :rtype: FrameReader
+    """
+    reader = readers.get(my_socket)
+    if reader is None:
+        reader = FrameReader(my_socket)
+        readers[my_socket] = reader
+    return reader
+
+
+def protocol_pending(my_socket):
+    """
+    check if a socket has complete messages buffered that select will not report as readable
+    :param my_socket: The socket object used to receive messages
+    :return: True if protocol_receive can return without reading from the socket
+    :rtype: bool
+    """
+    reader = readers.get(my_socket)
+    return reader is not None and reader.has_pending()
+
+
+def protocol_read(my_socket):
+    """
+    read the data available on a socket and keep the complete frames in it for protocol_receive
+    used with non blocking sockets, where waiting for a complete frame would block
+    :param my_socket: The socket object used to receive messages
+    :type my_socket: socket.socket
+    :return: True if a complete message is waiting to be received
+    :rtype: bool
+
+    :raises ConnectionResetError: If the socket was closed by the other side
+    """
+    reader = get_reader(my_socket)
+    reader.read_frames()
+    return reader.has_pending()
 
 
 def protocol_receive(my_socket):
@@ -13,25 +293,17 @@ def protocol_receive(my_socket):
     :param my_socket: The socket object used to receive the message
     :type my_socket: socket.socket
 
-    :return: message sent from client
-    :rtype: str
+    :return: message sent from client, binary messages are returned as bytes
+    :rtype: str or bytes
 
     :raises ConnectionResetError: If the connection was reset during the message receiving process
     :raises Exception: For any other exceptions that occur during the message receiving process
     """
-    final_message = ''
     try:
-        cur_char = ''
-        message_len = ''
-        while cur_char != SEPERATOR:
-            cur_char = my_socket.recv(1).decode()
-            if cur_char != SEPERATOR:
-                message_len += cur_char
-        for i in range(int(message_len)):
-            final_message += my_socket.recv(1).decode()
-        if SEPERATOR in final_message:
-            final_message = final_message.split(SEPERATOR, 1)[1]
-        return final_message
+        message = get_reader(my_socket).receive()
+        if message and message[0] in MESSAGE_TYPES:
+            return message
+        return message.decode()
     except ConnectionResetError as e:
         print(f"Connection was reset: {e}")
         raise
@@ -42,24 +314,45 @@ def protocol_receive(my_socket):
         raise
 
 
-def protocol_client_send(message):
+def receive_message(my_socket):
+    """
+    receive the next message from a socket and decode it
+    :param my_socket: The socket object used to receive the message
+    :type my_socket: socket.socket
+    :return: message type followed by its fields
+    :rtype: tuple
     """
-    send message with protocol
-    prepares a message to be sent to a server socket, following a specific protocol
-    where the message length is prepended to the message, separated by a separator character
+    return decode_message(protocol_receive(my_socket))
 
-    :param message: message to be sent
-    :type message: str
 
-    :return: message formatted according to the protocol.
-    :rtype: str
+if __name__ == '__main__':
+    # Assertions
 
-    :raises Exception: If any exception occurs during the message formatting process
-    """
+    # Check that frames split across feeds and several frames in one feed are parsed
+    parser = FrameParser()
+    frames = encode_frame("NUM$1") + encode_frame("UPD$False$1$EMPTY")
+    assert parser.feed(frames[:3]) == []
+    assert parser.feed(memoryview(frames)[3:]) == [b"NUM$1", b"UPD$False$1$EMPTY"]
+
+    # Check that a separator inside the payload is kept
+    assert FrameParser().feed(encode_frame("a|b")) == [b"a|b"]
+
+    # Check that both formats decode to the same message
+    for version in (TEXT_VERSION, BINARY_VERSION):
+        parser = FrameParser()
+        frames = (encode_message(version, 'DEK', [3, 0, 11]) + encode_message(version, 'DON', EMPTY, False, 2, False)
+                  + encode_message(version, 'UPD', True, 1, 7) + encode_message(version, 'DRW', 10, 5))
+        messages = [decode_message(message) for message in parser.feed(frames)]
+        assert messages == [('DEK', [3, 0, 11]), ('DON', EMPTY, False, 2, False), ('UPD', True, 1, 7),
+                            ('DRW', 10, 5)]
+
+    # Check that a binary deck is smaller than a text deck
+    deck = [9, 0, 3, 11, 10] * 7
+    assert len(encode_message(BINARY_VERSION, 'DEK', deck)) < len(encode_message(TEXT_VERSION, 'DEK', deck)) // 2
+
+    # Check that a binary frame with a short body is rejected like any other invalid message
     try:
-        message_len = len(message)
-        final_message = str(message_len) + SEPERATOR + message
-        return final_message
-    except Exception as e:
-        logging.info(traceback.format_exc())
-        return f"Error: {e}. Client message failed to send to server with protocol"
+        decode_message(bytes([MESSAGE_CODES['DON']]))
+        assert False, "a DON frame with no body was decoded"
+    except ValueError:
+        pass
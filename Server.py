@@ -1,25 +1,343 @@
 """
 author: Ofri Guz
 Date: 01/06/24
-description: server that handles multiple clients by using select
+description: server that hosts many game rooms and handles their clients by using selectors
 """
 import logging
 import socket
-import traceback
-import select
+import selectors
+import time
+from collections import deque
+import BotService
+import Game
+import Matchmaking
 import Start
+import State
 import Protocol
 
 # constants
 SERVER_IP = '0.0.0.0'  # Server IP address
 SERVER_PORT = 8820  # Server port number
 LISTEN_SIZE = 5
+HIGH_WATER_MARK = 64 * 1024  # Bytes that may wait to be sent to a client before it is disconnected
+MAX_ROOMS = 1000  # Rooms hosted at once, connections beyond them are rejected
+PREFERENCE_WAIT = 1  # Seconds to wait for a SIZ message before a client is queued for a table of any size
+STATS_INTERVAL = 10  # Seconds between reports of the server's stats
+BOT_WAIT = 60  # Seconds a client waits alone before the rest of its table is filled with bots, None for no bots
 SEPERATOR = '$'  # Separator used in messages
+NO_PLAYER = 0  # current player of an update followed by a pass or a win, so no client plays on it
 
 # global variables
-current_player = 0
-num_of_players = 0
-game_state = "WAITING"  # Variable to store the current state of the game
+rooms = []  # rooms hosted by the server
+client_rooms = {}  # room of each seated client socket
+matchmaking = Matchmaking.MatchmakingQueue()
+client_tickets = {}  # matchmaking ticket of each client socket waiting for a room, None until it is queued
+unqueued = deque()  # (connect time, socket) of clients that may still send their preferred table size
+client_versions = {}  # protocol version agreed with each client socket
+client_addresses = {}  # address of each client socket, kept from accept since getpeername fails once the peer reset
+outbound = {}  # bytes waiting to be sent to each client socket
+closing_sockets = []  # rejected sockets to close once everything queued for them was sent
+slow_clients = set()  # sockets that went over HIGH_WATER_MARK in queue_send, disconnected by the main loop
+selector: selectors.BaseSelector  # epoll on linux, the data of each key is the socket's event handler
+bot_service = None  # runs the moves of the bots in a pool of processes, None when bots are not seated
+dealers = {}  # Start.Dealer of each table size, keeps the decks of the next games prepared
+
+
+class GameRoom:
+    """
+    Single game hosted by the server, owns its sockets, state, discard pile and decks
+    """
+    def __init__(self, room_num_of_players):
+        """
+        Initialize the room
+        :param room_num_of_players: number of players needed to start the game
+        :type room_num_of_players: int
+        """
+        self.num_of_players = room_num_of_players
+        self.open_client_sockets = []  # sockets of the players, by player number
+        self.player_sockets = {}  # socket of each player number that is still connected
+        self.bots = []  # seats of the bots, numbered after the players
+        self.current_player = 0
+        self.game_state = "WAITING"  # Variable to store the current state of the game
+        self.discard_pile = []
+        self.pile_state = Game.PileState()  # effective top of the discard pile
+        self.decks = []
+        self.seed = None  # seed of the table's deal, Start.START(num_of_players, seed) deals it again
+        self.hands = []  # State.Hand of each player, by player number
+        self.personal_decks = []  # State.PersonalDeck of each player, by player number
+        self.messages = [None] * room_num_of_players  # lowest card of each player
+
+    def add_client(self, client_socket):
+        """
+        seat a new client, give it a player number and deal the decks once the room is full
+        :param client_socket:
+        """
+        self.open_client_sockets.append(client_socket)
+        client_rooms[client_socket] = self
+        # send_client(client_socket, "Connected")
+        player_num = len(self.open_client_sockets)
+        self.player_sockets[player_num] = client_socket
+        send_client(client_socket, num_message(player_num))
+        if player_num == self.num_of_players:
+            self.deal()
+
+    def add_bot(self, service):
+        """
+        seat a bot after the clients and deal the decks once the room is full
+        :param service: the service that runs the bot's moves
+        :type service: BotService.BotService
+        """
+        player_num = len(self.open_client_sockets) + len(self.bots) + 1
+        self.bots.append(service.seat(self, player_num))
+        if player_num == self.num_of_players:
+            self.deal()
+
+    def deal(self):
+        """
+        deal the decks to the clients and the bots
+        """
+        self.game_state = "PREP"
+        self.seed, self.decks = deal_decks(self.num_of_players)
+        logging.info("room of " + str(self.num_of_players) + " players dealt with seed " + str(self.seed))
+        print(self.decks)
+        self.hands = [State.Hand.from_cards(deck[:Game.HAND_SIZE]) for deck in self.decks]
+        self.personal_decks = [State.PersonalDeck.from_cards(deck[Game.HAND_SIZE:]) for deck in self.decks]
+        send_deck_to_all_clients(self.decks, self.open_client_sockets, 'DEK')
+        for bot in self.bots:
+            bot.receive_deck(self.decks[bot.number - 1])
+
+    def send_to_all(self, messages):
+        """
+        send messages to the clients and the bots of the room
+        :param messages: list of messages (message type followed by its fields)
+        """
+        broadcast(messages, self.open_client_sockets)
+        for bot in self.bots:
+            bot.handle_updates(messages)
+
+    def remove_client(self, client_socket):
+        """
+        remove a client that disconnected
+        :param client_socket:
+        """
+        self.open_client_sockets.remove(client_socket)
+        client_rooms.pop(client_socket, None)
+        for player_num, player_socket in list(self.player_sockets.items()):
+            if player_socket is client_socket:
+                del self.player_sockets[player_num]
+        if not self.open_client_sockets and self in rooms:
+            rooms.remove(self)
+            for bot in self.bots:
+                bot.leave()
+
+    def new_card_message(self, msg, did_win, msg_type):
+        """
+        Build a new card message for the current player
+        :param msg: card played
+        :param did_win: did any player win
+        :param msg_type: message type
+        :return: the message
+        """
+        return msg_type, did_win, self.current_player, msg
+
+    def send_new_card_to_all(self, msg, did_win, msg_type):
+        """
+        Send new card message to all players
+        :param msg: message to send
+        :param did_win: did any player win
+        :param msg_type: message type
+        :return:
+        """
+        self.send_to_all([self.new_card_message(msg, did_win, msg_type)])
+
+    def turn(self, message):
+        """
+        get a single turn from player and check if they won
+        send update (turn) to all players
+        :param message: decoded DON message from the player
+        :return:
+        """
+        new_card_placed, did_win_bool, player, did_turn_bool = receive_don_message(message)
+        print("New Card Placed:", new_card_placed, "Did Win: ", did_win_bool, "Player:", player,
+              "Did Turn:", did_turn_bool)
+        if player != self.current_player:
+            print("Received from wrong player")
+            logging.info("Received from wrong player")
+        else:
+            result = play_turn(self, player, new_card_placed, did_win_bool, did_turn_bool)
+            if result is None:
+                return
+            did_win_bool, new_card, updates = result
+            if did_turn_bool:
+                self.send_draw(player, new_card)
+            if did_win_bool:
+                self.game_state = "WIN"
+                logging.info('player ' + str(player) + "WON!")
+            # the turn and the win are sent to each player together
+            self.send_to_all(updates)
+
+    def send_draw(self, player, new_card):
+        """
+        send the card a player drew to its client, if the client speaks DRAW_VERSION
+        older clients got their whole deck and draw from it themselves
+        :param player: the player that played a card
+        :param new_card: the card drawn, None if the personal deck is empty
+        """
+        client_socket = self.player_sockets.get(player)
+        if client_socket is not None and get_version(client_socket) >= Protocol.DRAW_VERSION:
+            queue_send(client_socket, draw_message(get_version(client_socket), new_card,
+                                                   len(self.personal_decks[player - 1])))
+
+    def skip_players_without_valid_card(self):
+        """
+        pass for the current player and the players after it while they have no valid card,
+        instead of waiting for their clients to pass
+        :return: True if any player passed
+        """
+        self.current_player, passes = skip_players(self.pile_state, self.hands, self.current_player)
+        if passes:
+            self.discard_pile = []
+        return passes > 0
+
+    def player_number(self, sender):
+        """
+        get the player number of the seat a message came from
+        :param sender: socket of a client, or the seat of a bot
+        :return: the player number, None if the sender is not seated in the room
+        """
+        if sender in self.bots:
+            return sender.number
+        for player_num, player_socket in self.player_sockets.items():
+            if player_socket is sender:
+                return player_num
+        return None
+
+    def handle_client_message(self, current_socket, message):
+        """
+        handle a single message from a client according to the game state
+        the player field of LOW and DON messages must be the player number of the sender
+        :param current_socket: the socket of the client that sent the message
+        :param message: decoded message from the client
+        """
+        if message[0] in ('LOW', 'DON') and message[3] != self.player_number(current_socket):
+            logging.warning("message as player " + str(message[3]) + " from player "
+                            + str(self.player_number(current_socket)) + ": " + str(message))
+            return
+        if self.game_state == "PREP":
+            logging.info("IN PREP")
+            lowest_cards = receive_low_message_type(message, 'LOW', self.messages)
+            if is_full(self.messages):
+                print("All low messages received:", self.messages)
+                self.current_player = Game.pick_starting_player(lowest_cards)
+                print("The starting player is player " + str(self.current_player))
+                logging.info("The starting player is player " + str(self.current_player))
+                self.skip_players_without_valid_card()
+                # send_play(current_player, msg_type, client_socket)
+                self.send_new_card_to_all("EMPTY", False, "UPD")
+                self.game_state = "PLAY"
+        elif self.game_state == "PLAY":
+            logging.info("IN PLAY")
+            self.turn(message)
+        elif self.game_state == "WIN":
+            logging.info("IN WIN")
+        # send win message
+        #     exit()
+
+
+def handle_size_message(client_socket, message):
+    """
+    queue a waiting client for a table of the size it prefers
+    :param client_socket:
+    :param message: decoded SIZ message
+    """
+    if client_socket not in client_tickets:
+        logging.info("SIZ message from a seated client")
+        return
+    # the new preference is queued before the old ticket is cancelled, so an invalid one leaves the client queued
+    try:
+        new_ticket = matchmaking.add(client_socket, message[1])
+    except ValueError as e:
+        logging.info("client " + str(client_addresses.get(client_socket)) + " sent " + str(e))
+        return
+    ticket = client_tickets[client_socket]
+    if ticket is not None:
+        matchmaking.cancel(ticket)
+    client_tickets[client_socket] = new_ticket
+    logging.info("client " + str(client_addresses.get(client_socket)) + " waits for a table of " + str(message[1]))
+
+
+def queue_unqueued(now):
+    """
+    queue the clients that did not send their preferred table size in time for a table of any size
+    :param now: current time
+    """
+    while unqueued and unqueued[0][0] + PREFERENCE_WAIT <= now:
+        connect_time, client_socket = unqueued.popleft()
+        if client_socket in client_tickets and client_tickets[client_socket] is None:
+            client_tickets[client_socket] = matchmaking.add(client_socket, Matchmaking.ANY)
+
+
+def start_matched_tables(now):
+    """
+    open a room for every table the matchmaking queue formed
+    :param now: current time
+    """
+    for table in matchmaking.match(now):
+        room = GameRoom(len(table))
+        rooms.append(room)
+        for client_socket in table:
+            del client_tickets[client_socket]
+            room.add_client(client_socket)
+        logging.info("opened a room for " + str(len(table)) + " players, matchmaking: " + str(matchmaking.stats()))
+
+
+def seat_bots(now):
+    """
+    open a room for every client that waited alone for BOT_WAIT seconds and fill the rest of its table with bots
+    :param now: current time
+    """
+    for preference in matchmaking.waiting:
+        ticket = matchmaking.oldest(preference)
+        while ticket is not None and now - ticket.enqueue_time >= BOT_WAIT:
+            table = []
+            matchmaking.take(preference, 1, now, table)
+            room = GameRoom(Matchmaking.MIN_PLAYERS if preference == Matchmaking.ANY else preference)
+            rooms.append(room)
+            del client_tickets[table[0]]
+            room.add_client(table[0])
+            while room.game_state == "WAITING":
+                room.add_bot(bot_service)
+            logging.info("opened a room for a client with " + str(len(room.bots)) + " bots")
+            ticket = matchmaking.oldest(preference)
+
+
+def next_timeout(now, next_report=None):
+    """
+    get how long the main loop may wait for events before matchmaking or reporting has work to do
+    :param now: current time
+    :param next_report: time of the next stats report, None if stats are not reported
+    :return: seconds to wait, None to wait until an event
+    """
+    deadlines = [matchmaking.next_deadline(), next_report]
+    if unqueued:
+        deadlines.append(unqueued[0][0] + PREFERENCE_WAIT)
+    if bot_service is not None:
+        deadlines.append(bot_service.next_deadline())
+        deadlines += [ticket.enqueue_time + BOT_WAIT for ticket in map(matchmaking.oldest, matchmaking.waiting)
+                      if ticket is not None]
+    deadlines = [deadline for deadline in deadlines if deadline is not None]
+    if not deadlines:
+        return None
+    return max(0, min(deadlines) - now)
+
+
+def num_message(player_num):
+    """
+    build the NUM message that tells a client its player number
+    :param player_num: player number
+    :return: the message
+    """
+    return "NUM" + SEPERATOR + SEPERATOR.join(map(str, str(player_num)))
 
 
 def send_deck_to_all_clients(decks, open_client_sockets, msg_type):
@@ -33,113 +351,252 @@ def send_deck_to_all_clients(decks, open_client_sockets, msg_type):
     player = 1
     for client_socket in open_client_sockets:
         message = decks[player - 1]
-        message_str = msg_type + SEPERATOR + SEPERATOR.join(map(str, message))
-        try:
-            message_str = Protocol.protocol_client_send(message_str)
-            client_socket.send(message_str.encode())
-            logging.info("sending deck message: " + message_str)
-        except socket.error as e:
-            logging.error(f"Error sending message to {client_socket.getpeername()}: {e}")
+        queue_send(client_socket, deck_message(get_version(client_socket), msg_type, message))
+        logging.info("sending deck message: " + str(message))
         player = player + 1
 
 
-def send_new_card_to_all(msg, did_win, open_client_sockets, msg_type):
+def broadcast(messages, open_client_sockets):
     """
-    Send new card message to all players
-    :param msg: message to send
-    :param did_win: did any player win
-    :param open_client_sockets:
-    :param msg_type: message type
+    Send messages to all players
+    every message is serialized once per protocol version, and all the messages are sent
+    to each player in a single frame
+    :param messages: list of messages (message type followed by its fields)
+    :param open_client_sockets: list of clients to send the messages to
     :return:
     """
-    global current_player
+    print("sending to all", messages)
+    logging.info("sending to all: " + str(messages))
+    frames = {}  # the messages encoded for each protocol version
     for client_socket in open_client_sockets:
-        message_str = msg_type + SEPERATOR + str(did_win) + SEPERATOR + str(current_player) + SEPERATOR + msg
-        print("sending new card to all (UPDATE MESSAGE)", message_str)
-        message_str = Protocol.protocol_client_send(message_str)
-        try:
-            client_socket.send(message_str.encode())
-            logging.info("sending " + msg_type + " message: " + message_str)
-        except socket.error as e:
-            logging.info(traceback.format_exc())
-            logging.error(f"Error sending message to {client_socket.getpeername()}: {e}")
+        version = get_version(client_socket)
+        frame = frames.get(version)
+        if frame is None:
+            frame = b''.join(Protocol.encode_message(version, *message) for message in messages)
+            frames[version] = frame
+        queue_send(client_socket, frame)
 
 
-def receive_low_message_type(client_socket, msg_type, messages):
+def get_version(client_socket):
     """
-    Receive the lowest card from each player
+    get the protocol version agreed with a client
     :param client_socket:
+    :return: the agreed version, the text version if the client never sent HEL
+    """
+    return client_versions.get(client_socket, Protocol.TEXT_VERSION)
+
+
+def handle_hello_message(client_socket, message):
+    """
+    agree on a protocol version with a client that sent HEL and reply with the agreed version
+    :param client_socket:
+    :param message: decoded HEL message
+    """
+    version = min(message[1], Protocol.PROTOCOL_VERSION)
+    logging.info("client " + str(client_addresses.get(client_socket)) + " uses protocol version " + str(version))
+    queue_send(client_socket, Protocol.encode_message(Protocol.TEXT_VERSION, 'HEL', version))
+    client_versions[client_socket] = version
+
+
+def receive_low_message_type(message, msg_type, messages):
+    """
+    Receive the lowest card from each player
+    :param message: decoded message from the client
     :param msg_type: Message type (LOW)
     :param messages: array of all the lowest cards received
     :return: messages array
     """
-    try:
-        data = Protocol.protocol_receive(client_socket)
-        if data:
-            if not data.startswith(msg_type + SEPERATOR):
-                raise ValueError("Invalid message format: Message does not start with 'low$'")
-            logging.info("received LOW message : " + data)
-            # Remove the leading '$' character
-            data = data[4:]
-            card_sent, ignore, player, ignore = data.split(SEPERATOR)
-            # message, player = parse(data)
-            messages[int(player) - 1] = card_sent
-    except socket.error as e:
-        print(f"Socket error: {e}")
-        logging.error(f"Socket error: {e}")
+    if message[0] != msg_type:
+        raise ValueError("Invalid message format: Message is not a LOW message")
+    logging.info("received LOW message : " + str(message))
+    card_sent, ignore, player, ignore = message[1:]
+    messages[player - 1] = card_sent
     return messages
 
 
-def pick_starting_player(lowest_cards):
+def is_valid_move(pile_state, hand, card):
+    """
+    check a card played against the rules and the player's hand, in O(1)
+    :param pile_state: the discard pile
+    :type pile_state: Game.PileState
+    :param hand: the player's hand
+    :type hand: State.Hand
+    :param card: card played, as decoded from the DON message
+    :return: True if the card is in the hand and may be played on the pile
+    :rtype: bool
+    """
+    return card in range(Game.NUM_OF_CARDS) and card in hand and pile_state.is_card_valid(card)
+
+
+def play_card(hands, personal_decks, player, card):
     """
-    Pick the starting player
-    Choose the player with the lowest card
-    :param lowest_cards: array of the lowest card of each player
-    :return: Starting player
+    remove a card played from a player's hand and draw the next card of its personal deck, like the client does
+    :param hands: State.Hand of each player, by player number
+    :param personal_decks: State.PersonalDeck of each player, by player number
+    :param player: the player
+    :param card: a card in the player's hand
+    :return: the card drawn, None if the personal deck is empty
     """
-    if not lowest_cards:
-        raise ValueError("The list of cards is empty")
-    lowest_card = min(lowest_cards)
-    if lowest_card == 15:
-        return 1
-    return lowest_cards.index(lowest_card) + 1
+    new_card, personal_decks[player - 1] = personal_decks[player - 1].draw()
+    hands[player - 1] = hands[player - 1].play(card, new_card)
+    return new_card
 
 
-def logout(current_socket, open_client_sockets):
+def play_turn(table, player, new_card_placed, claimed_win, did_turn):
+    """
+    play the DON message of the current player on a table (GameRoom or AsyncServer.Table):
+    check the card, play it from the player's hand or pass, decide the win from the player's hand,
+    pass for the next players that have no valid card and build the updates for all the players
+    :param table: the table, with hands, personal_decks, pile_state, discard_pile, current_player
+    and num_of_players
+    :param player: the current player
+    :param new_card_placed: card played
+    :param claimed_win: did_win of the DON message, only logged since the server decides the win
+    :param did_turn: False if the player passed
+    :return: None if the card is not valid, otherwise did_win, the card drawn (None if no card was drawn)
+    and the list of updates
+    :rtype: tuple
+    """
+    if did_turn and not is_valid_move(table.pile_state, table.hands[player - 1], new_card_placed):
+        logging.warning("player " + str(player) + " played invalid card " + str(new_card_placed))
+        return None
+    new_card = None
+    passes = 0
+    if did_turn:
+        new_card = play_card(table.hands, table.personal_decks, player, new_card_placed)
+        table.discard_pile.append(new_card_placed)
+        table.pile_state.push(new_card_placed)
+    else:
+        # the player passed, the discard pile is cleared like the clients do
+        table.discard_pile = []
+        table.pile_state.reset()
+    # the player won if its hand is empty, whatever its client claims
+    did_win = did_turn and len(table.hands[player - 1]) == 0
+    if did_win != claimed_win:
+        logging.warning("player " + str(player) + " claimed did_win " + str(claimed_win) + " wrongly")
+    if not did_win:
+        table.current_player, passes = skip_players(table.pile_state, table.hands,
+                                                    (table.current_player % table.num_of_players) + 1)
+        if passes:
+            table.discard_pile = []
+    updates = []
+    if did_turn:
+        # when players passed after the card or it won, it is sent with no current player so no client plays on it
+        updates.append(('UPD', False, NO_PLAYER if passes or did_win else table.current_player, new_card_placed))
+    if passes or not did_turn:
+        # a single update for all the players that passed
+        updates.append(('UPD', False, table.current_player, Protocol.EMPTY))
+    if did_win:
+        updates.append(('UPD', True, table.current_player, new_card_placed))
+    return did_win, new_card, updates
+
+
+def deal_decks(num_of_players):
+    """
+    get the decks of a new table from the dealer of its size, which keeps them prepared in batches
+    :param num_of_players: number of players at the table
+    :return: the table's seed, Start.START(num_of_players, seed) deals the table again, and a list of
+    each player's deck
+    :rtype: tuple
+    """
+    dealer = dealers.get(num_of_players)
+    if dealer is None:
+        dealer = Start.Dealer(num_of_players)
+        dealers[num_of_players] = dealer
+    return dealer.deal()
+
+
+def deck_message(version, msg_type, deck):
+    """
+    encode the DEK message that deals a player its deck
+    clients that speak DRAW_VERSION get only their hand, the rest of the deck stays on the server
+    and is sent a card at a time
+    :param version: protocol version of the client
+    :param msg_type: type of message (dek)
+    :param deck: the player's personal deck
+    :return: the encoded message
+    :rtype: bytes
+    """
+    if version >= Protocol.DRAW_VERSION:
+        return (Protocol.encode_message(version, msg_type, deck[:Game.HAND_SIZE])
+                + draw_message(version, None, len(deck) - Game.HAND_SIZE))
+    return Protocol.encode_message(version, msg_type, deck)
+
+
+def draw_message(version, new_card, cards_left):
+    """
+    encode the DRW message that tells a client the card it drew
+    :param version: protocol version of the client
+    :param new_card: the card drawn, None if the personal deck is empty
+    :param cards_left: number of cards left in the personal deck
+    :return: the encoded message
+    :rtype: bytes
+    """
+    return Protocol.encode_message(version, 'DRW', Protocol.EMPTY if new_card is None else new_card, cards_left)
+
+
+def skip_players(pile_state, hands, current_player):
+    """
+    pass for the current player and the players after it while they have no valid card,
+    the discard pile is cleared after every pass
+    :param pile_state: the discard pile
+    :type pile_state: Game.PileState
+    :param hands: State.Hand of each player, by player number
+    :param current_player: the current player
+    :return: the first player that has a valid card and the number of passes
+    :rtype: tuple
+    """
+    passes = 0
+    while not pile_state.have_valid_card(hands[current_player - 1].cards()):
+        if passes == len(hands):
+            logging.warning("no player has a valid card")
+            break
+        logging.info("player " + str(current_player) + " has no valid card, passing")
+        pile_state.reset()
+        current_player = (current_player % len(hands)) + 1
+        passes += 1
+    return current_player, passes
+
+
+def logout(current_socket):
     """
     perform logout for the user holding the current socket, remove the user
-    from the open sockets list and close the socket
+    from its room and close the socket
     :param current_socket: the socket to perform the operation on
-    :param open_client_sockets: the list of open sockets
     :return: None
     """
+    client_versions.pop(current_socket, None)
+    client_addresses.pop(current_socket, None)
+    outbound.pop(current_socket, None)
+    selector.unregister(current_socket)
     # Close the socket
     current_socket.close()
-    # Remove the socket from the list of open client sockets
-    open_client_sockets.remove(current_socket)
+    if current_socket in client_tickets:
+        # Remove the socket from the matchmaking queue
+        ticket = client_tickets.pop(current_socket)
+        if ticket is not None:
+            matchmaking.cancel(ticket)
+    else:
+        # Remove the socket from the open client sockets of its room
+        client_rooms[current_socket].remove_client(current_socket)
 
 
-def receive_don_message(my_socket):
+def receive_don_message(message):
     """
     Receive DON message from player that finished their turn
-    :param my_socket:
+    :param message: decoded message from the client
     :return:
         new_card_placed: the card they played
         did_win: if they won
         player: their player num
         did_turn: if they had any valid cards and did their turn
     """
-    message_str = Protocol.protocol_receive(my_socket)
-    logging.info('received msg: ' + message_str)
-    if not message_str:
-        logging.error("Received empty message from server")
-        raise ValueError("Received empty message from server")
-    if not message_str.startswith('DON$'):
-        logging.error("Invalid message format: Message does not start with 'DON$'")
-        raise ValueError("Invalid message format: Message does not start with 'DON$'")
-    message_str = message_str[4:]
-    new_card_placed, did_win, player, did_turn = message_str.split(SEPERATOR)
-    return new_card_placed, did_win, int(player), did_turn
+    logging.info('received msg: ' + str(message))
+    if message[0] != 'DON':
+        logging.error("Invalid message format: Message is not a DON message")
+        raise ValueError("Invalid message format: Message is not a DON message")
+    new_card_placed, did_win, player, did_turn = message[1:]
+    return new_card_placed, did_win, player, did_turn
 
 
 def send_client(client_socket, msg):
@@ -148,48 +605,90 @@ def send_client(client_socket, msg):
     :param client_socket:
     :param msg: message to send
     """
-    msg = Protocol.protocol_client_send(msg)
     logging.info('sending message: ' + msg)
-    client_socket.send(msg.encode())
+    queue_send(client_socket, Protocol.encode_frame(msg))
 
 
-def turn(discard_pile, open_client_sockets, server_socket):
+def queue_send(client_socket, data):
     """
-    get a single turn from player and check if they won
-    send update (turn) to all players
-    :param discard_pile: the current discard pile
-    :param open_client_sockets: the connected players
-    :param server_socket: the server socket
-    :return:
+    queue data to be sent to a client once its socket is writable
+    :param client_socket:
+    :param data: encoded frames to send
     """
-    # send_new_card_to_all("Empty", False, current_player, open_client_sockets, "UPD")
-    global current_player
-    global game_state
-    did_win_bool = True
-    did_turn_bool = True
-    new_card_placed, did_win, player, did_turn = receive_don_message(server_socket)
-    if did_win == "False":
-        did_win_bool = False
-    if did_turn == "False":
-        did_turn_bool = False
-    print("New Card Placed:", new_card_placed, "Did Win: ", did_win, "Player:", player, "Did Turn:", did_turn)
-    player = int(player)
-    current_player = int(current_player)
-    if player != current_player:
-        print("Received from wrong player")
-        logging.info("Received from wrong player")
-    else:
-        if did_win_bool is False:
-            current_player = (current_player % num_of_players) + 1
-        if did_turn_bool:
-            discard_pile += new_card_placed
-            send_new_card_to_all(new_card_placed, False, open_client_sockets, "UPD")
+    buffer = outbound.get(client_socket)
+    if buffer is None:
+        buffer = bytearray()
+        outbound[client_socket] = buffer
+    if not buffer:
+        watch_writes(client_socket, True)
+    buffer += data
+    if len(buffer) > HIGH_WATER_MARK:
+        # disconnected from the main loop, not in the middle of sending to its room
+        slow_clients.add(client_socket)
+
+
+def watch_writes(client_socket, watch):
+    """
+    add or remove write events from the events the selector waits for on a client socket
+    :param client_socket:
+    :param watch: True while there is data waiting to be sent
+    """
+    key = selector.get_key(client_socket)
+    events = selectors.EVENT_READ if client_socket not in closing_sockets else 0
+    if watch:
+        events |= selectors.EVENT_WRITE
+    if events != key.events:
+        selector.modify(client_socket, events, key.data)
+
+
+def flush(client_socket):
+    """
+    send as much of the data queued for a client as its socket accepts, keeping the rest
+    :param client_socket: a writable client socket
+    """
+    buffer = outbound[client_socket]
+    try:
+        sent = client_socket.send(buffer)
+    except BlockingIOError:
+        return
+    except socket.error as e:
+        logging.error(f"Error sending message to client: {e}")
+        disconnect(client_socket)
+        return
+    del buffer[:sent]
+    if not buffer:
+        if client_socket in closing_sockets:
+            disconnect(client_socket)
         else:
-            send_new_card_to_all("EMPTY", False, open_client_sockets, "UPD")
-        if did_win_bool is True:
-            game_state = "WIN"
-            logging.info('player ' + str(player) + "WON!")
-            send_new_card_to_all(new_card_placed, True, open_client_sockets, "UPD")
+            watch_writes(client_socket, False)
+
+
+def disconnect(client_socket):
+    """
+    close a client socket, whether it is a player or a rejected connection
+    :param client_socket:
+    """
+    if client_socket in closing_sockets:
+        closing_sockets.remove(client_socket)
+        client_versions.pop(client_socket, None)
+        outbound.pop(client_socket, None)
+        selector.unregister(client_socket)
+        client_socket.close()
+    elif client_socket in client_rooms or client_socket in client_tickets:
+        logout(client_socket)
+
+
+def disconnect_slow_clients():
+    """
+    disconnect the clients queue_send found with more than HIGH_WATER_MARK bytes waiting to be sent,
+    so a client that stopped reading can not grow the server's memory without limit
+    """
+    while slow_clients:
+        client_socket = slow_clients.pop()
+        buffer = outbound.get(client_socket)
+        if buffer is not None and len(buffer) > HIGH_WATER_MARK:
+            logging.warning("disconnecting slow client, " + str(len(buffer)) + " bytes waiting to be sent")
+            disconnect(client_socket)
 
 
 def is_full(messages):
@@ -205,101 +704,161 @@ def is_full(messages):
     return True
 
 
-def main_loop():
+def accept_client(server_socket, events):
+    """
+    accept a new connection, it waits for a room until matchmaking seats it in a table
+    :param server_socket: the listening socket
+    :param events: the selector events that are ready
+    """
+    client_socket, client_address = server_socket.accept()
+    client_socket.setblocking(False)
+    logging.info('received a new connection from '
+                 + str(client_address[0]) + ':'
+                 + str(client_address[1]))
+    if len(rooms) < MAX_ROOMS:
+        selector.register(client_socket, selectors.EVENT_READ, handle_client_events)
+        client_tickets[client_socket] = None
+        client_addresses[client_socket] = client_address
+        unqueued.append((time.monotonic(), client_socket))
+    else:
+        closing_sockets.append(client_socket)
+        selector.register(client_socket, selectors.EVENT_WRITE, handle_client_events)
+        send_client(client_socket, "Too Many Players: Unable to Connect")
+        logging.info("sending message : too many players")
+
+
+def handle_client_events(client_socket, events):
+    """
+    flush queued data to a writable client and handle the complete messages of a readable one
+    :param client_socket: the client socket
+    :param events: the selector events that are ready
+    """
+    if events & selectors.EVENT_WRITE:
+        flush(client_socket)
+    if not events & selectors.EVENT_READ or not is_connected(client_socket):
+        return
+    try:
+        Protocol.protocol_read(client_socket)
+    except BlockingIOError:
+        return
+    except (socket.error, ValueError) as e:
+        logging.info('client disconnected, ' + str(e))
+        logout(client_socket)
+        return
+    # handle every complete message, partial frames wait in the reader for more data
+    while is_connected(client_socket) and Protocol.protocol_pending(client_socket):
+        message = None
+        try:
+            message = Protocol.receive_message(client_socket)
+            if message[0] == 'HEL':
+                handle_hello_message(client_socket, message)
+            elif message[0] == 'SIZ':
+                handle_size_message(client_socket, message)
+            elif client_socket in client_rooms:
+                client_rooms[client_socket].handle_client_message(client_socket, message)
+            else:
+                logging.info("message from a client waiting for a room: " + str(message))
+        except ValueError as e:
+            logging.error("Invalid message " + str(message) + ": " + str(e))
+
+
+def is_connected(client_socket):
+    """
+    check if a socket belongs to a client that is seated in a room or waiting for one
+    :param client_socket:
+    :return: True if the client is connected
     """
-    main server loop, waits for messages from clients and acts according to game state
+    return client_socket in client_rooms or client_socket in client_tickets
+
+
+def get_stats():
+    """
+    get the server's stats
+    :return: number of rooms, seated players and players waiting for a room, and the matchmaking metrics
+    :rtype: dict
+    """
+    return {
+        'rooms': len(rooms),
+        'players': len(client_rooms),
+        'waiting': len(client_tickets),
+        'matchmaking': matchmaking.stats(),
+    }
+
+
+def main_loop(reuse_port=False, report=None, num_of_bot_workers=BotService.NUM_OF_WORKERS):
+    """
+    main server loop, waits for messages from clients and passes them to their rooms
+    tables are formed by the matchmaking queue between events
+    every socket is registered once in the selector, with the function that handles its events
+    :param reuse_port: True to bind with SO_REUSEPORT, so several processes share the port
+    :param report: function called with get_stats() every STATS_INTERVAL seconds, None to not report
+    :param num_of_bot_workers: number of processes of this server's bot pool
     :return: None, endless loop
     """
-    global num_of_players, current_player, game_state
+    global selector, bot_service
+    # created here and not on import, so every forked worker gets its own epoll instance and bot processes
+    selector = selectors.DefaultSelector()
+    if BOT_WAIT is not None:
+        bot_service = BotService.BotService(num_of_bot_workers)
+        selector.register(bot_service.wakeup_socket, selectors.EVENT_READ, bot_service.handle_events)
     server_socket = socket.socket()
-    discard_pile = []
-    open_client_sockets = []
-    send_sockets = []
-    messages = [None] * num_of_players
+    next_report = time.monotonic() + STATS_INTERVAL if report is not None else None
     try:
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_socket.bind((SERVER_IP, SERVER_PORT))
         server_socket.listen(LISTEN_SIZE)
+        server_socket.setblocking(False)
+        selector.register(server_socket, selectors.EVENT_READ, accept_client)
         while True:
-            rlist, wlist, xlist = select.select([server_socket]
-                                                + open_client_sockets,
-                                                send_sockets, open_client_sockets)
-            # print(datetime.datetime.now())
-            # check for exception
-            # for current_socket in xlist:
-            #     logging.info('handling exception socket')
-            #     logout(current_socket, open_client_sockets, mngr)
-            for current_socket in rlist:
-                # check for new connection
-                if current_socket is server_socket:
-                    client_socket, client_address = current_socket.accept()
-                    logging.info('received a new connection from '
-                                 + str(client_address[0]) + ':'
-                                 + str(client_address[1]))
-                    open_client_sockets.append(client_socket)
-                    if len(open_client_sockets) <= num_of_players and game_state == "WAITING":
-                        # send_client(client_socket, "Connected")
-                        player_num = len(open_client_sockets)
-                        message_str = "NUM" + SEPERATOR + SEPERATOR.join(map(str, str(player_num)))
-                        send_client(client_socket, message_str)
-                        if player_num == num_of_players:
-                            game_state = "PREP"
-                            start = Start.START(num_of_players)
-                            # player_decks = start.create_cards()
-                            player_decks = start.create_cards()
-                            print(player_decks)
-                            send_deck_to_all_clients(player_decks, open_client_sockets, 'DEK')
-                    else:
-                        send_client(client_socket, "Too Many Players: Unable to Connect")
-                        logging.info("sending message : too many players")
-                        logout(client_socket, open_client_sockets)
-
-                else:
-                    if game_state == "PREP":
-                        logging.info("IN PREP")
-                        lowest_cards = receive_low_message_type(current_socket, 'LOW', messages)
-                        if is_full(messages):
-                            print("All low messages received:", messages)
-                            current_player = pick_starting_player(lowest_cards)
-                            print("The starting player is player " + str(current_player))
-                            logging.info("The starting player is player " + str(current_player))
-                            # send_play(current_player, msg_type, client_socket)
-                            send_new_card_to_all("EMPTY", False, open_client_sockets, "UPD")
-                            game_state = "PLAY"
-                    elif game_state == "PLAY":
-                        logging.info("IN PLAY")
-                        turn(discard_pile, open_client_sockets, current_socket)
-                    elif game_state == "WIN":
-                        logging.info("IN WIN")
-                    # send win message
-                    #     exit()
+            disconnect_slow_clients()
+            for key, events in selector.select(next_timeout(time.monotonic(), next_report)):
+                key.data(key.fileobj, events)
+            now = time.monotonic()
+            queue_unqueued(now)
+            start_matched_tables(now)
+            if bot_service is not None:
+                bot_service.expire(now)
+                seat_bots(now)
+            if next_report is not None and now >= next_report:
+                report(get_stats())
+                next_report = now + STATS_INTERVAL
 
     except socket.error as err:
         logging.info('received socket error, ' + str(err))
     finally:
+        if bot_service is not None:
+            bot_service.close()
+        selector.close()
         server_socket.close()
 
 
-def main():
+def ask_num_of_players():
     """
-    gets num of players and calls main loop - for the game to start
+    ask how many people are playing
+    :return: number of players, between 2 and 4
     """
-    global num_of_players
     while True:
         num_of_players_str = input("How many people are playing? ")
         if num_of_players_str == "":
-            num_of_players = 2  # default number of players
-            break
+            return 2  # default number of players
         try:
-            num_of_players = int(num_of_players_str)
-            if 2 <= num_of_players <= 4:
-                break
+            num_of_players_input = int(num_of_players_str)
+            if 2 <= num_of_players_input <= 4:
+                return num_of_players_input
             else:
                 print("Invalid number of participants. Please enter a number between 2 and 4.")
         except ValueError:
             print("Invalid input. Please enter a number between 2 and 4.")
-    print(f"Number of players set to: {num_of_players}")
+
+
+def main():
+    """
+    calls main loop - tables start as players connect
+    """
+    print("Waiting for players, tables of " + str(Matchmaking.MIN_PLAYERS) + " to " + str(Matchmaking.MAX_PLAYERS))
     main_loop()
 
 
@@ -307,11 +866,30 @@ if __name__ == '__main__':
     # Assertions
 
     # Check if the starting player pick function returns a valid player number
-    assert pick_starting_player([3, 6, 2, 9]) in range(2, 5)
+    assert Game.pick_starting_player([3, 6, 2, 9]) in range(2, 5)
 
     # Check if the is_full function correctly identifies if the messages array is full
     assert not is_full([1, None, 3, 4])
     assert is_full([1, 2, 3, 4])
 
+    # Check if the move check rejects a card that is not in the hand or not valid on the pile
+    test_pile = Game.PileState([9])
+    assert is_valid_move(test_pile, State.Hand.from_cards([9, 1, 2]), 9)
+    assert not is_valid_move(test_pile, State.Hand.from_cards([1, 2, 3]), 9)
+    assert not is_valid_move(test_pile, State.Hand.from_cards([9, 1, 2]), 1)
+
+    # Check if playing a card draws the next card of the personal deck, and nothing once it is empty
+    test_hands = [State.Hand.from_cards([1, 2, 3]), State.Hand.from_cards([4, 5, 6])]
+    test_decks = [State.PersonalDeck.from_cards([7]), State.PersonalDeck.from_cards([])]
+    assert play_card(test_hands, test_decks, 1, 2) == 7
+    assert sorted(test_hands[0].cards()) == [1, 3, 7] and len(test_decks[0]) == 0
+    assert play_card(test_hands, test_decks, 1, 7) is None and sorted(test_hands[0].cards()) == [1, 3]
+    assert play_card(test_hands, test_decks, 2, 4) is None and sorted(test_hands[1].cards()) == [5, 6]
+
+    # Check if the players with no valid card are passed over, and the pile is cleared for the next player
+    test_hands = [State.Hand.from_cards([1, 2, 3]), State.Hand.from_cards([4, 5, 6])]
+    assert skip_players(test_pile, test_hands, 1) == (2, 1) and test_pile.is_card_valid(4)
+    assert skip_players(test_pile, test_hands, 2) == (2, 0)
+
     logging.basicConfig(filename="server.log", level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s',)
     main()
@@ -0,0 +1,208 @@
+"""
+author: Ofri Guz
+Date: 01/06/24
+description: headless simulator that plays many games with bots in a pool of processes and aggregates their results
+"""
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+import Game
+import Matchmaking
+import Start
+
+#  constants
+NUM_OF_WORKERS = os.cpu_count() or 1  # Default number of worker processes, one per core
+NUM_OF_GAMES = 100000  # Default number of games to simulate
+CHUNK_SIZE = 1000  # Games played by a worker for every task it gets from the pool
+MAX_TURNS = 1000  # Turns before a game that can not end (every hand only has special cards) is a draw
+
+
+def random_bot(hand, pile_state, rng):
+    """
+    bot that plays a random valid card
+    :param hand: cards in the player's hand, at least one of them is valid
+    :type hand: list
+    :param pile_state: the discard pile
+    :type pile_state: Game.PileState
+    :param rng: random generator of the game
+    :type rng: random.Random
+    :return: the card to play
+    :rtype: int
+    """
+    return rng.choice([card for card in hand if pile_state.is_card_valid(card)])
+
+
+def lowest_bot(hand, pile_state, rng):
+    """
+    bot that plays its lowest valid number card and keeps ZERO, GHOST and HALF for when it has nothing else
+    :param hand: cards in the player's hand, at least one of them is valid
+    :param pile_state: the discard pile
+    :param rng: random generator of the game
+    :return: the card to play
+    :rtype: int
+    """
+    valid_cards = [card for card in hand if pile_state.is_card_valid(card)]
+    number_cards = [card for card in valid_cards if card != Game.ZERO and card < Game.GHOST]
+    return min(number_cards) if number_cards else min(valid_cards)
+
+
+BOTS = {'random': random_bot, 'lowest': lowest_bot}  # bot policies by name, workers get the names
+
+
+def lowest_card(hand):
+    """
+    Finds lowest yellow card in a hand, the player with the lowest yellow card starts
+    :param hand: cards in the player's hand
+    :return: the lowest yellow card or Game.NO_YELLOW_CARD if there are no yellow cards
+    """
+    yellow_cards = [card for card in hand if 1 <= card <= 4 or 6 <= card <= 9]
+    return min(yellow_cards) if yellow_cards else Game.NO_YELLOW_CARD
+
+
+def play_game(bots, seed):
+    """
+    play a whole game without sockets or GUI, with the client's rules:
+    every player holds 3 cards and refills them from its personal deck, a player with no valid card
+    passes and the discard pile is cleared, the first player to empty its hand wins
+    :param bots: bot policy of each player, in the order they sit
+    :type bots: list
+    :param seed: seed of the game, the same seed always plays the same game
+    :type seed: int
+    :return: the winning player (1 for the first player) or None for a draw, number of turns, number of passes
+    :rtype: tuple
+    """
+    num_of_players = len(bots)
+    rng = random.Random(seed)
+    decks = [list(deck) for deck in Start.START(num_of_players, seed).create_cards()]
+    hands = [deck[:Game.HAND_SIZE] for deck in decks]
+    decks = [deck[Game.HAND_SIZE:] for deck in decks]
+    current_player = Game.pick_starting_player([lowest_card(hand) for hand in hands]) - 1
+    pile_state = Game.PileState()
+    passes = 0
+    for turn in range(1, MAX_TURNS + 1):
+        hand = hands[current_player]
+        if not pile_state.have_valid_card(hand):
+            pile_state.reset()
+            passes += 1
+        else:
+            card = bots[current_player](hand, pile_state, rng)
+            pile_state.push(card)
+            hand.remove(card)
+            deck = decks[current_player]
+            if deck:
+                hand.append(deck.pop(0))
+            elif not hand:
+                return current_player + 1, turn, passes
+        current_player = (current_player + 1) % num_of_players
+    return None, MAX_TURNS, passes
+
+
+def new_stats(num_of_players):
+    """
+    create empty simulation results
+    :param num_of_players: number of players in each game
+    :return: the results
+    :rtype: dict
+    """
+    return {'games': 0, 'wins': [0] * num_of_players, 'draws': 0, 'turns': 0, 'longest_game': 0, 'passes': 0}
+
+
+def add_stats(totals, stats):
+    """
+    add the results of some games to the totals
+    :param totals: results to add to
+    :param stats: results of more games
+    """
+    totals['games'] += stats['games']
+    totals['wins'] = [total + wins for total, wins in zip(totals['wins'], stats['wins'])]
+    totals['draws'] += stats['draws']
+    totals['turns'] += stats['turns']
+    totals['longest_game'] = max(totals['longest_game'], stats['longest_game'])
+    totals['passes'] += stats['passes']
+
+
+def play_games(task):
+    """
+    worker task, plays a range of games
+    :param task: names of the bots, seed of the first game and number of games
+    :type task: tuple
+    :return: results of the games
+    :rtype: dict
+    """
+    bot_names, first_seed, num_of_games = task
+    bots = [BOTS[name] for name in bot_names]
+    stats = new_stats(len(bots))
+    for seed in range(first_seed, first_seed + num_of_games):
+        winner, turns, passes = play_game(bots, seed)
+        stats['games'] += 1
+        if winner is None:
+            stats['draws'] += 1
+        else:
+            stats['wins'][winner - 1] += 1
+        stats['turns'] += turns
+        stats['longest_game'] = max(stats['longest_game'], turns)
+        stats['passes'] += passes
+    return stats
+
+
+def simulate(bot_names, num_of_games, seed=0, num_of_workers=NUM_OF_WORKERS, chunk_size=CHUNK_SIZE):
+    """
+    play many games in a pool of processes, game i is played with seed + i so the results do not
+    depend on the number of workers
+    :param bot_names: name of the bot of each player (keys of BOTS)
+    :type bot_names: list
+    :param num_of_games: number of games to play
+    :param seed: seed of the first game
+    :param num_of_workers: number of worker processes, 1 plays in this process
+    :param chunk_size: games played by a worker for every task
+    :return: win rate of each player, draws, average and longest game length and pass frequency
+    :rtype: dict
+    """
+    for name in bot_names:
+        if name not in BOTS:
+            raise ValueError(f"Unknown bot: {name}")
+    if not Matchmaking.MIN_PLAYERS <= len(bot_names) <= Matchmaking.MAX_PLAYERS:
+        raise ValueError(f"Invalid number of players: {len(bot_names)}")
+    tasks = [(tuple(bot_names), first_seed, min(chunk_size, seed + num_of_games - first_seed))
+             for first_seed in range(seed, seed + num_of_games, chunk_size)]
+    totals = new_stats(len(bot_names))
+    if num_of_workers == 1:
+        for task in tasks:
+            add_stats(totals, play_games(task))
+    else:
+        with multiprocessing.Pool(num_of_workers) as pool:
+            for stats in pool.imap_unordered(play_games, tasks):
+                add_stats(totals, stats)
+    games = totals['games']
+    return {
+        'games': games,
+        'bots': list(bot_names),
+        'win_rates': [wins / games if games else 0.0 for wins in totals['wins']],
+        'draws': totals['draws'],
+        'average_length': totals['turns'] / games if games else 0.0,
+        'longest_game': totals['longest_game'],
+        'pass_frequency': totals['passes'] / totals['turns'] if totals['turns'] else 0.0,
+    }
+
+
+def main():
+    """
+    simulates the number of games given on the command line with the bots given after it
+    """
+    num_of_games = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_OF_GAMES
+    bot_names = sys.argv[2:] or ['random', 'lowest']
+    print(f"Simulating {num_of_games} games of {bot_names} on {NUM_OF_WORKERS} workers")
+    start = time.monotonic()
+    results = simulate(bot_names, num_of_games)
+    elapsed = time.monotonic() - start
+    print("Results:", results)
+    print(f"{num_of_games / elapsed:.0f} games per second")
+    logging.info("simulation results: " + str(results))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename="simulator.log", level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s',)
+    main()
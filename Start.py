@@ -4,34 +4,154 @@ Date: 01/06/24
 description: start class that prepares decks for game
 """
 import random
+from collections import deque
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
+#  constants
+FULL_DECK = tuple(list(range(1, 3)) * 4 + list(range(3, 10)) * 6 + list(range(0, 1)) * 6 + list(range(10, 12)) * 8)
+MAX_SEED = 2 ** 32  # Seeds of tables that were not given one are picked below this
+BATCH_SIZE = 256  # Games a Dealer prepares at once
+MASK_64 = (1 << 64) - 1  # the shuffle keys are 64 bit, like NumPy's uint64
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15  # splitmix64 constants
+MIX_1 = 0xBF58476D1CE4E5B9
+MIX_2 = 0x94D049BB133111EB
 
-class START:
-    def __init__(self, num_of_players):
 
+class START:
+    def __init__(self, num_of_players, seed=None):
+        """
+        Initialize the dealing of a table
+        :param num_of_players: number of players at the table
+        :param seed: seed of the table (a non negative int), the same seed always deals the same decks;
+        None picks a random seed that is kept in the 'seed' attribute so the game can be reproduced
+        """
         self.num_of_players = num_of_players
+        self.seed = random.randrange(MAX_SEED) if seed is None else seed
         self.decks = []
         self.removed_cards = []
 
     def create_cards(self):
         """
         Create deck of cards and split according to number of players
-        creates a full deck of cards, shuffles it, and then splits it into individual decks for each player.
-        The decks are stored in the 'decks' attribute
+        shuffles a full deck of cards by the table's seed, and then splits it into individual decks for each player.
+        The decks are stored in the 'decks' attribute, every call deals the same decks in place of the old ones
 
         :return: A list of each player's deck.
         :rtype: list of tuples
         """
-        full_deck = list(range(1, 3)) * 4 + list(range(3, 10)) * 6 + list(range(0, 1)) * 6 + list(range(10, 12)) * 8
-        random.shuffle(full_deck)
-        tuple_length = len(full_deck) // self.num_of_players
-        # split into personal decks
-        for i in range(self.num_of_players):
-            start_index = i * tuple_length
-            end_index = (i + 1) * tuple_length
-            split_deck = tuple(full_deck[start_index:end_index])
-            self.decks.append(split_deck)
+        keys = [shuffle_key(self.seed, position) for position in range(len(FULL_DECK))]
+        # sorted is stable, like the argsort of create_batch
+        full_deck = [FULL_DECK[position] for position in sorted(range(len(FULL_DECK)), key=keys.__getitem__)]
+        self.decks = split_deck(full_deck, self.num_of_players)
         # PRINT DECKS
         #  for i, deck in enumerate(self.decks, start=1):
         #    print(f"deck_{i}:", deck)
         return self.decks
+
+
+class Dealer:
+    """
+    Keeps the decks of the next tables of a size ready, prepared a batch at a time with create_batch,
+    so dealing a table never waits on shuffling
+    every table gets its own seed from the dealer's generator, START(num_of_players, seed) deals it again
+    """
+    def __init__(self, num_of_players, seed=None, batch_size=BATCH_SIZE):
+        """
+        Initialize the dealer
+        :param num_of_players: number of players at every table
+        :param seed: seed of the generator of the table seeds, None for a random seed
+        :param batch_size: tables prepared at once
+        """
+        self.num_of_players = num_of_players
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.prepared = deque()  # (seed, decks) of the tables prepared and not dealt yet
+
+    def deal(self):
+        """
+        get the seed and the decks of the next table
+        :return: the table's seed and a list of each player's deck
+        :rtype: tuple
+        """
+        if not self.prepared:
+            seeds = [self.rng.randrange(MAX_SEED) for i in range(self.batch_size)]
+            self.prepared.extend(zip(seeds, create_batch(self.num_of_players, seeds)))
+        return self.prepared.popleft()
+
+
+def shuffle_key(seed, position):
+    """
+    get the sort key of a position of the full deck, splitmix64 of the seed and the position
+    :param seed: seed of the table
+    :param position: position in FULL_DECK
+    :return: 64 bit key
+    :rtype: int
+    """
+    key = (seed * len(FULL_DECK) + position + GOLDEN_GAMMA) & MASK_64
+    key = ((key ^ (key >> 30)) * MIX_1) & MASK_64
+    key = ((key ^ (key >> 27)) * MIX_2) & MASK_64
+    return key ^ (key >> 31)
+
+
+def create_batch(num_of_players, seeds):
+    """
+    Create the decks of many tables at once, the same decks START(num_of_players, seed).create_cards() deals
+    with NumPy the shuffle keys of all the tables are computed in one preallocated array and sorted with
+    a single argsort; without NumPy the tables are dealt one by one
+
+    :param num_of_players: number of players at every table
+    :param seeds: seed of each table
+    :return: A list of tables, each a list of each player's deck.
+    :rtype: list
+    """
+    if np is None:
+        return [START(num_of_players, seed).create_cards() for seed in seeds]
+    keys = np.empty((len(seeds), len(FULL_DECK)), dtype=np.uint64)
+    keys[:] = np.asarray(seeds, dtype=np.uint64)[:, None] * np.uint64(len(FULL_DECK))
+    keys += np.arange(len(FULL_DECK), dtype=np.uint64) + np.uint64(GOLDEN_GAMMA)
+    keys ^= keys >> np.uint64(30)
+    keys *= np.uint64(MIX_1)
+    keys ^= keys >> np.uint64(27)
+    keys *= np.uint64(MIX_2)
+    keys ^= keys >> np.uint64(31)
+    cards = np.asarray(FULL_DECK, dtype=np.uint8)[np.argsort(keys, axis=1, kind='stable')]
+    deck_length = len(FULL_DECK) // num_of_players
+    tables = cards[:, :deck_length * num_of_players].reshape(len(seeds), num_of_players, deck_length)
+    return [[tuple(deck) for deck in table] for table in tables.tolist()]
+
+
+def split_deck(full_deck, num_of_players):
+    """
+    split a shuffled deck into personal decks, the cards left over are not dealt
+    :param full_deck: the shuffled cards
+    :param num_of_players: number of players
+    :return: A list of each player's deck.
+    :rtype: list of tuples
+    """
+    tuple_length = len(full_deck) // num_of_players
+    # split into personal decks
+    return [tuple(full_deck[i * tuple_length:(i + 1) * tuple_length]) for i in range(num_of_players)]
+
+
+if __name__ == '__main__':
+    # Assertions
+    start = START(3, seed=7)
+    first = start.create_cards()
+    assert start.create_cards() == first and len(start.decks) == 3
+    assert START(3, seed=7).create_cards() == first and START(3, seed=8).create_cards() != first
+    assert all(len(deck) == len(FULL_DECK) // 3 for deck in first)
+    assert sorted(card for deck in START(2, seed=7).create_cards() for card in deck) == sorted(FULL_DECK)
+
+    # Check that a batch deals every table like START with the table's seed
+    seeds = [0, 7, MAX_SEED - 1]
+    assert create_batch(4, seeds) == [START(4, seed).create_cards() for seed in seeds]
+
+    # Check that the dealer's tables are dealt again from their seeds
+    dealer = Dealer(2, seed=7, batch_size=2)
+    tables = [dealer.deal() for i in range(3)]
+    assert all(START(2, seed).create_cards() == decks for seed, decks in tables)
+    same_dealer = Dealer(2, seed=7, batch_size=3)
+    assert [seed for seed, decks in tables] == [same_dealer.deal()[0] for i in range(3)]
@@ -0,0 +1,323 @@
+"""
+author: Ofri Guz
+Date: 01/06/24
+description: compact immutable game state (hand, discard pile, personal deck) packed into ints and bytes
+"""
+import struct
+import Game
+
+#  constants
+CARD_BITS = 4  # every card (0 to 11) fits in 4 bits
+CARD_MASK = (1 << CARD_BITS) - 1
+NO_CARD = 0  # nibble of an empty slot, cards are stored as card + 1
+STATE_HEADER = struct.Struct('!BBH')  # number of players, current player, packed pile (low 16 bits)
+PILE_SIZE_SHIFT = 14  # the pile size is packed above base, halves, ghost_over_half and top
+PLAYER_HEADER = struct.Struct('!HB')  # packed hand, length of the personal deck
+
+
+class Packed:
+    """
+    Base class of the immutable state types, compared and hashed by their packed value
+    """
+    __slots__ = ('packed',)
+
+    def __init__(self, packed):
+        """
+        Initialize the value
+        :param packed: the packed value (int or bytes)
+        """
+        object.__setattr__(self, 'packed', packed)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.packed == other.packed
+
+    def __hash__(self):
+        return hash((type(self), self.packed))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.packed!r})"
+
+
+class Hand(Packed):
+    """
+    Cards in a player's hand, one nibble per card in the order they are held
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_cards(cls, cards):
+        """
+        pack a hand
+        :param cards: cards in the hand (at most 4)
+        :type cards: list
+        :return: the hand
+        :rtype: Hand
+        """
+        packed = 0
+        for i, card in enumerate(cards):
+            packed |= (card + 1) << (i * CARD_BITS)
+        return cls(packed)
+
+    def cards(self):
+        """
+        :return: cards in the hand
+        :rtype: list
+        """
+        cards = []
+        packed = self.packed
+        while packed:
+            cards.append((packed & CARD_MASK) - 1)
+            packed >>= CARD_BITS
+        return cards
+
+    def mask(self):
+        """
+        :return: bitmask of the cards in the hand, like Game.hand_mask
+        :rtype: int
+        """
+        return Game.hand_mask(self.cards())
+
+    def play(self, card, new_card=None):
+        """
+        remove a card from the hand and put the card drawn from the deck at the end, like GUI.replace_chosen_card
+        :param card: card played
+        :param new_card: card drawn, None if the deck is empty
+        :return: the new hand
+        :rtype: Hand
+        """
+        cards = self.cards()
+        cards.remove(card)
+        if new_card is not None:
+            cards.append(new_card)
+        return Hand.from_cards(cards)
+
+    def __contains__(self, card):
+        packed = self.packed
+        while packed:
+            if (packed & CARD_MASK) == card + 1:
+                return True
+            packed >>= CARD_BITS
+        return False
+
+    def __len__(self):
+        return (self.packed.bit_length() + CARD_BITS - 1) // CARD_BITS
+
+
+class Pile(Packed):
+    """
+    Discard pile, packs the fields of Game.PileState: base, halves, ghost_over_half, top and size
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_pile_state(cls, pile_state):
+        """
+        pack a pile state
+        :param pile_state: the pile state
+        :type pile_state: Game.PileState
+        :return: the pile
+        :rtype: Pile
+        """
+        base = NO_CARD if pile_state.base is None else pile_state.base + 1
+        top = NO_CARD if pile_state.top is None else pile_state.top + 1
+        return cls(base | pile_state.halves << 4 | pile_state.ghost_over_half << 9 | top << 10
+                   | pile_state.size << PILE_SIZE_SHIFT)
+
+    @classmethod
+    def from_cards(cls, discard_pile):
+        """
+        pack a discard pile
+        :param discard_pile: cards in the discard pile
+        :return: the pile
+        :rtype: Pile
+        """
+        return cls.from_pile_state(Game.PileState(discard_pile))
+
+    def pile_state(self):
+        """
+        :return: a PileState with the fields of the pile
+        :rtype: Game.PileState
+        """
+        pile_state = Game.PileState()
+        base = self.packed & CARD_MASK
+        top = self.packed >> 10 & CARD_MASK
+        pile_state.base = None if base == NO_CARD else base - 1
+        pile_state.halves = self.packed >> 4 & 0x1F
+        pile_state.ghost_over_half = bool(self.packed >> 9 & 1)
+        pile_state.top = None if top == NO_CARD else top - 1
+        pile_state.size = self.packed >> PILE_SIZE_SHIFT
+        pile_state.state = Game.pile_state_id(pile_state.value())
+        return pile_state
+
+    def push(self, card):
+        """
+        :param card: card played
+        :return: the pile with the card on top
+        :rtype: Pile
+        """
+        pile_state = self.pile_state()
+        pile_state.push(card)
+        return Pile.from_pile_state(pile_state)
+
+    def rules_key(self):
+        """
+        get the part of the pile the rules depend on, piles with the same key accept the same cards
+        now and after any card played (the size is left out)
+        :return: the key
+        :rtype: int
+        """
+        return self.packed & ((1 << PILE_SIZE_SHIFT) - 1)
+
+
+EMPTY_PILE = Pile(0)
+
+
+class PersonalDeck(Packed):
+    """
+    Cards left in a player's personal deck, one byte per card in the order they are drawn
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_cards(cls, cards):
+        """
+        pack a personal deck
+        :param cards: cards in the deck
+        :return: the deck
+        :rtype: PersonalDeck
+        """
+        return cls(bytes(cards))
+
+    def cards(self):
+        """
+        :return: cards in the deck
+        :rtype: list
+        """
+        return list(self.packed)
+
+    def draw(self):
+        """
+        draw the top card
+        :return: the card (None if the deck is empty) and the rest of the deck
+        :rtype: tuple
+        """
+        if not self.packed:
+            return None, self
+        return self.packed[0], PersonalDeck(self.packed[1:])
+
+    def __len__(self):
+        return len(self.packed)
+
+
+class GameState(Packed):
+    """
+    Snapshot of a whole game: hand and deck of every player, discard pile and current player
+    packed as the bytes of encode_state
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_parts(cls, hands, decks, pile, current_player):
+        """
+        pack a game
+        :param hands: Hand of every player
+        :param decks: PersonalDeck of every player
+        :param pile: the discard pile
+        :type pile: Pile
+        :param current_player: player whose turn it is (1 for the first player)
+        :return: the game state
+        :rtype: GameState
+        """
+        return cls(encode_state(hands, decks, pile, current_player))
+
+    def parts(self):
+        """
+        :return: hands, decks, pile and current player
+        :rtype: tuple
+        """
+        return decode_state(self.packed)
+
+
+def encode_state(hands, decks, pile, current_player):
+    """
+    encode a game into bytes
+    :param hands: Hand of every player
+    :param decks: PersonalDeck of every player
+    :param pile: the discard pile
+    :param current_player: player whose turn it is
+    :return: encoded game
+    :rtype: bytes
+    """
+    parts = [STATE_HEADER.pack(len(hands), current_player, pile.packed & 0xFFFF), bytes([pile.packed >> 16])]
+    for hand, deck in zip(hands, decks):
+        parts.append(PLAYER_HEADER.pack(hand.packed, len(deck.packed)))
+        parts.append(deck.packed)
+    return b''.join(parts)
+
+
+def decode_state(data):
+    """
+    decode a game encoded by encode_state
+    :param data: encoded game
+    :type data: bytes
+    :return: hands, decks, pile and current player
+    :rtype: tuple
+    :raises ValueError: If the data is not an encoded game
+    """
+    if len(data) < STATE_HEADER.size + 1:
+        raise ValueError("Invalid game state")
+    num_of_players, current_player, low_pile = STATE_HEADER.unpack_from(data)
+    pile = Pile(low_pile | data[STATE_HEADER.size] << 16)
+    offset = STATE_HEADER.size + 1
+    hands = []
+    decks = []
+    for i in range(num_of_players):
+        if len(data) < offset + PLAYER_HEADER.size:
+            raise ValueError("Invalid game state")
+        hand, deck_length = PLAYER_HEADER.unpack_from(data, offset)
+        offset += PLAYER_HEADER.size
+        if len(data) < offset + deck_length:
+            raise ValueError("Invalid game state")
+        hands.append(Hand(hand))
+        decks.append(PersonalDeck(data[offset:offset + deck_length]))
+        offset += deck_length
+    if offset != len(data):
+        raise ValueError("Invalid game state")
+    return tuple(hands), tuple(decks), pile, current_player
+
+
+if __name__ == '__main__':
+    # Assertions
+    hand = Hand.from_cards([3, Game.GHOST, 0])
+    assert hand.cards() == [3, Game.GHOST, 0] and len(hand) == 3
+    assert 0 in hand and Game.GHOST in hand and 4 not in hand
+    assert hand.play(Game.GHOST, 7) == Hand.from_cards([3, 0, 7])
+    assert hand.mask() == Game.hand_mask([3, Game.GHOST, 0])
+
+    # Check that piles keep the ghost and half rules of PileState
+    for cards in ([], [5, Game.HALF, Game.HALF, Game.GHOST], [8, Game.HALF], [2, 7, Game.GHOST]):
+        pile = Pile.from_cards(cards)
+        assert pile.pile_state().state == Game.PileState(cards).state
+        assert pile.pile_state().size == len(cards)
+    assert Pile.from_cards([4]).push(Game.HALF) == Pile.from_cards([4, Game.HALF])
+    assert Pile.from_cards([]) == EMPTY_PILE
+
+    # Check that decks draw from the top
+    deck = PersonalDeck.from_cards([9, 1, Game.HALF])
+    card, deck = deck.draw()
+    assert card == 9 and deck.cards() == [1, Game.HALF]
+
+    # Check that a game encodes and decodes into equal, hashable values
+    state = GameState.from_parts((hand, Hand.from_cards([1, 2])), (deck, PersonalDeck.from_cards([])),
+                                 Pile.from_cards([6, Game.HALF]), 2)
+    assert GameState(state.packed) == state and hash(GameState(state.packed)) == hash(state)
+    assert state.parts() == ((hand, Hand.from_cards([1, 2])), (deck, PersonalDeck.from_cards([])),
+                             Pile.from_cards([6, Game.HALF]), 2)
+    try:
+        state.current = 1
+        assert False
+    except AttributeError:
+        pass
@@ -0,0 +1,132 @@
+"""
+author: Ofri Guz
+Date: 01/06/24
+description: supervisor that runs the server in several worker processes sharing the port with SO_REUSEPORT
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import Server
+
+#  constants
+NUM_OF_WORKERS = os.cpu_count() or 1  # Default number of worker processes, one per core
+RESTART_DELAY = 1  # Seconds to wait before restarting a worker that exited
+STATS_INTERVAL = Server.STATS_INTERVAL  # Seconds between logs of the aggregated stats
+BOT_WORKERS = 1  # Bot processes of each worker, the workers already take a core each
+
+
+def run_worker(stats_queue):
+    """
+    worker process, runs a server loop with its own rooms and reports its stats to the supervisor
+    :param stats_queue: queue of (pid, stats) read by the supervisor
+    :type stats_queue: multiprocessing.Queue
+    """
+    pid = os.getpid()
+    Server.main_loop(reuse_port=True, report=lambda stats: stats_queue.put((pid, stats)),
+                     num_of_bot_workers=BOT_WORKERS)
+
+
+class Supervisor:
+    """
+    Starts the worker processes, restarts workers that exit and aggregates their stats
+    """
+    def __init__(self, num_of_workers):
+        """
+        Initialize the supervisor
+        :param num_of_workers: number of worker processes
+        :type num_of_workers: int
+        """
+        self.num_of_workers = num_of_workers
+        self.stats_queue = multiprocessing.Queue()
+        self.workers = [None] * num_of_workers  # process of each worker slot
+        self.worker_stats = {}  # last stats reported by each worker pid
+        self.restarts = 0
+
+    def start_worker(self, slot):
+        """
+        start the worker process of a slot
+        :param slot: index of the worker
+        """
+        # not daemonic, so the worker may start the processes of its bots; run terminates the workers when it stops
+        process = multiprocessing.Process(target=run_worker, args=(self.stats_queue,), daemon=False)
+        process.start()
+        self.workers[slot] = process
+        logging.info("started worker " + str(slot) + " pid " + str(process.pid))
+
+    def restart_exited_workers(self):
+        """
+        restart every worker whose process exited
+        """
+        for slot, process in enumerate(self.workers):
+            if not process.is_alive():
+                logging.error("worker " + str(slot) + " pid " + str(process.pid)
+                              + " exited with code " + str(process.exitcode) + ", restarting")
+                self.worker_stats.pop(process.pid, None)
+                process.join()
+                time.sleep(RESTART_DELAY)
+                self.start_worker(slot)
+                self.restarts += 1
+
+    def aggregate_stats(self):
+        """
+        add up the last stats of every worker
+        :return: totals of all the workers
+        :rtype: dict
+        """
+        totals = {'workers': len(self.worker_stats), 'restarts': self.restarts,
+                  'rooms': 0, 'players': 0, 'waiting': 0, 'matched': 0, 'longest_wait': 0.0}
+        total_wait = 0.0
+        for stats in self.worker_stats.values():
+            totals['rooms'] += stats['rooms']
+            totals['players'] += stats['players']
+            totals['waiting'] += stats['waiting']
+            matchmaking = stats['matchmaking']
+            totals['matched'] += matchmaking['matched']
+            total_wait += matchmaking['average_wait'] * matchmaking['matched']
+            totals['longest_wait'] = max(totals['longest_wait'], matchmaking['longest_wait'])
+        totals['average_wait'] = total_wait / totals['matched'] if totals['matched'] else 0.0
+        return totals
+
+    def run(self):
+        """
+        start the workers and supervise them forever
+        """
+        if not hasattr(Server.socket, 'SO_REUSEPORT'):
+            raise OSError("SO_REUSEPORT is not supported on this platform")
+        for slot in range(self.num_of_workers):
+            self.start_worker(slot)
+        next_log = time.monotonic() + STATS_INTERVAL
+        try:
+            while True:
+                try:
+                    pid, stats = self.stats_queue.get(timeout=RESTART_DELAY)
+                    self.worker_stats[pid] = stats
+                except queue.Empty:
+                    pass
+                self.restart_exited_workers()
+                if time.monotonic() >= next_log:
+                    stats = self.aggregate_stats()
+                    print("Stats:", stats)
+                    logging.info("stats: " + str(stats))
+                    next_log = time.monotonic() + STATS_INTERVAL
+        finally:
+            for process in self.workers:
+                if process is not None:
+                    process.terminate()
+
+
+def main():
+    """
+    runs the supervisor with the number of workers given on the command line, one per core by default
+    """
+    num_of_workers = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_OF_WORKERS
+    print(f"Starting {num_of_workers} workers on port {Server.SERVER_PORT}")
+    Supervisor(num_of_workers).run()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename="server.log", level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s',)
+    main()